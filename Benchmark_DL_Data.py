@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from shutil import rmtree
+
+import Process_DL_Data
+
+# rows per table at scale 1, roughly the size of a real master data dump
+BASE_ROW_COUNTS = {
+    'AbilityLimitedGroup': 20,
+    'AbilityShiftGroup': 40,
+    'AbilityData': 400,
+    'AmuletData': 150,
+    'BuildEventItem': 20,
+    'CharaData': 120,
+    'CollectEventItem': 20,
+    'SkillData': 300,
+    'DragonData': 80,
+    'ExAbilityData': 150,
+    'EmblemData': 200,
+    'FortPlantDetail': 300,
+    'FortPlantData': 30,
+    'MaterialData': 200,
+    'RaidEventItem': 20,
+    'MissionDailyData': 40,
+    'MissionPeriodData': 40,
+    'MissionNormalData': 200,
+    'QuestData': 800,
+    'QuestRewardData': 600,
+    'QuestEvent': 60,
+    'WeaponData': 300,
+    'WeaponCraftTree': 250,
+    'WeaponCraftData': 250,
+}
+# real tables carry plenty of columns the parsers never read
+FILLER_COLUMNS = 30
+DEFAULT_SCALES = '1,10,100'
+# timings under this many seconds are too noisy to compare against a baseline
+MIN_COMPARE_TIME = 0.05
+
+def numbered(prefix, start, stop, suffix=''):
+    return ['{}{}{}'.format(prefix, i, suffix) for i in range(start, stop)]
+
+class SyntheticMasterData:
+    def __init__(self, out_dir, scale=1, seed=0):
+        self.out_dir = out_dir
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.labels = {}
+        self.labels_jp = {}
+
+    def count(self, table):
+        return max(1, int(BASE_ROW_COUNTS[table] * self.scale))
+
+    def word(self):
+        return self.rng.choice(('Flame', 'Tide', 'Gale', 'Light', 'Shadow', 'Blade', 'Heart', 'Star', 'Dawn', 'Dusk'))
+
+    def label(self, key, text=None):
+        if text is None:
+            text = ' '.join(self.word() for _ in range(self.rng.randint(1, 4)))
+            if self.rng.random() < 0.1:
+                text += '\\n' + self.word()
+        self.labels[key] = text
+        self.labels_jp[key] = text + ' JP'
+        return key
+
+    def num(self, low=0, high=9999):
+        return str(self.rng.randint(low, high))
+
+    def write_table(self, table, columns, rows, tabs=False):
+        columns = ['_Id'] + columns + numbered('_Unused', 0, FILLER_COLUMNS)
+        with open(os.path.join(self.out_dir, table + Process_DL_Data.EXT), 'w', newline='', encoding='utf-8') as out_file:
+            writer = csv.writer(out_file, dialect='excel-tab' if tabs else 'excel')
+            writer.writerow(columns)
+            writer.writerow(['0'] * len(columns))
+            for row in rows:
+                writer.writerow([row.get(c, '0') for c in columns])
+
+    def write_labels(self):
+        for table, labels in ((Process_DL_Data.TEXT_LABEL, self.labels), (Process_DL_Data.TEXT_LABEL_JP, self.labels_jp)):
+            with open(os.path.join(self.out_dir, table + Process_DL_Data.EXT), 'w', newline='', encoding='utf-8') as out_file:
+                writer = csv.writer(out_file, dialect='excel-tab')
+                writer.writerow(['_Id', '_Text'])
+                for key, text in labels.items():
+                    writer.writerow([key, text])
+
+    def generate(self):
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        skill_ids = self.skill_data()
+        self.ability_data()
+        self.amulet_data()
+        self.material_data()
+        self.chara_data(skill_ids)
+        self.dragon_data(skill_ids)
+        self.ex_ability_data()
+        self.emblem_data()
+        self.fort_plant_data()
+        self.mission_data()
+        self.quest_data()
+        self.weapon_data(skill_ids)
+        self.write_labels()
+
+    def skill_data(self):
+        columns = ['_Name'] + numbered('_SkillLv', 1, 4, 'IconName') + numbered('_Description', 1, 4) + \
+            ['_Sp', '_SpLv2', '_IsAffectedByTension', '_ZoominTime', '_Zoom2Time', '_ZoomWaitTime']
+        rows = []
+        for i in range(self.count('SkillData')):
+            sid = str(100000 + i)
+            row = {'_Id': sid, '_Name': self.label('SKILL_NAME_' + sid), '_Sp': self.num(1000, 9000),
+                   '_SpLv2': self.num(1000, 9000), '_IsAffectedByTension': self.num(0, 1),
+                   '_ZoominTime': '0.5', '_Zoom2Time': '1.2', '_ZoomWaitTime': '0.3'}
+            for j in range(1, 4):
+                row['_SkillLv{}IconName'.format(j)] = 'Icon_Skill_{:03d}'.format(i % 1000)
+                row['_Description{}'.format(j)] = self.label('SKILL_DETAIL_{}_{}'.format(sid, j))
+            rows.append(row)
+        self.write_table(Process_DL_Data.SKILL_DATA_NAME, columns, rows)
+        return [r['_Id'] for r in rows]
+
+    def ability_data(self):
+        limited = []
+        for i in range(self.count('AbilityLimitedGroup')):
+            gid = str(i + 1)
+            limited.append({'_Id': gid, '_MaxLimitedValue': self.num(1, 20),
+                            '_AbilityLimitedText': self.label('ABILITY_LIMITED_' + gid, 'Up to {ability_limit0}% ' + self.word())})
+        self.write_table('AbilityLimitedGroup', ['_AbilityLimitedText', '_MaxLimitedValue'], limited)
+
+        ability_ids = [str(200000000 + i) for i in range(self.count('AbilityData'))]
+        shifts = []
+        for i in range(self.count('AbilityShiftGroup')):
+            row = {'_Id': str(i + 1), '_AmuletEffectMaxLevel': '3'}
+            for j in range(1, 6):
+                row['_Level{}'.format(j)] = self.rng.choice(ability_ids)
+            shifts.append(row)
+        self.write_table('AbilityShiftGroup', ['_AmuletEffectMaxLevel'] + numbered('_Level', 1, 6), shifts)
+
+        rows = []
+        for aid in ability_ids:
+            element = self.rng.randint(0, 5)
+            name = '({}) {} {{ability_shift0}}'.format(self.word(), self.word()) if self.rng.random() < 0.5 \
+                else '{} +{{ability_val0}}%'.format(self.word())
+            details = '{element_owner} ' if self.rng.random() < 0.3 else ''
+            details += 'When HP is above {ability_cond0}%, increase ' + self.word() + ' by {ability_val0}%.'
+            rows.append({'_Id': aid, '_PartyPowerWeight': self.num(),
+                         '_ShiftGroupId': self.rng.choice(('0', str(self.rng.randint(1, len(shifts))))),
+                         '_AbilityType1UpValue': self.rng.choice(('0', '5', '10', '15')),
+                         '_Name': self.label('ABILITY_NAME_' + aid, name),
+                         '_Details': self.label('ABILITY_DETAIL_' + aid, details),
+                         '_ElementalType': str(element), '_ConditionValue': self.num(0, 100),
+                         '_AbilityIconName': 'Icon_Ability_{}'.format(aid[-7:]),
+                         '_ViewAbilityGroupId1': self.num(1, 300),
+                         '_AbilityLimitedGroupId1': self.num(0, 20),
+                         '_AbilityLimitedGroupId2': '0', '_AbilityLimitedGroupId3': '0'})
+        self.write_table('AbilityData', ['_PartyPowerWeight', '_ShiftGroupId', '_AbilityType1UpValue', '_Name', '_Details',
+                                         '_ElementalType', '_ConditionValue', '_AbilityIconName', '_ViewAbilityGroupId1'] +
+                         numbered('_AbilityLimitedGroupId', 1, 4), rows)
+
+    def amulet_data(self):
+        abilities = ['_Abilities{}{}'.format(i, j) for i in range(1, 4) for j in range(1, 4)]
+        columns = ['_BaseId', '_Name', '_Rarity', '_AmuletType', '_MinHp', '_MaxHp', '_MinAtk', '_MaxAtk', '_VariationId'] + \
+            abilities + numbered('_Text', 1, 6) + ['_IsPlayable', '_SellCoin', '_SellDewPoint']
+        rows = []
+        for i in range(self.count('AmuletData')):
+            aid = str(400000 + i)
+            row = {'_Id': aid, '_BaseId': aid, '_Name': self.label('AMULET_NAME_' + aid), '_Rarity': self.num(2, 5),
+                   '_AmuletType': self.num(1, 4), '_MinHp': self.num(), '_MaxHp': self.num(), '_MinAtk': self.num(),
+                   '_MaxAtk': self.num(), '_VariationId': '1', '_IsPlayable': '1', '_SellCoin': self.num(),
+                   '_SellDewPoint': self.num()}
+            for k in abilities:
+                row[k] = self.num(200000000, 200000400)
+            for j in range(1, 6):
+                row['_Text{}'.format(j)] = self.label('AMULET_TEXT_{}_{}'.format(aid, j))
+            rows.append(row)
+        self.write_table('AmuletData', columns, rows)
+
+    def material_data(self):
+        common = ['_Name', '_Detail', '_Description'] + numbered('_MoveQuest', 1, 6) + ['_PouchRarity']
+        for table, extra in (('MaterialData', ['_MaterialRarity', '_Exp']),
+                             ('BuildEventItem', ['_EventId']),
+                             ('RaidEventItem', ['_RaidEventId']),
+                             ('CollectEventItem', ['_QuestEventId', '_Category', '_SortId'])):
+            rows = []
+            for i in range(self.count(table)):
+                mid = str(100000000 + i) if table == 'MaterialData' else str(10000000 + 1000 * len(table) + i)
+                row = {'_Id': mid, '_Name': self.label(Process_DL_Data.MATERIAL_NAME_LABEL + mid), '_Detail': self.label('MATERIAL_DETAIL_' + mid),
+                       '_Description': self.label('MATERIAL_DESCRIPTION_' + mid), '_PouchRarity': self.num(1, 5)}
+                for k in extra:
+                    row[k] = self.num(1, 50000)
+                for j in range(1, 6):
+                    row['_MoveQuest{}'.format(j)] = self.num(0, 300000000)
+                rows.append(row)
+            self.write_table(table, common + extra, rows)
+
+    def chara_data(self, skill_ids):
+        stats = []
+        for stat in ('Hp', 'Atk'):
+            stats += ['_Min{}{}'.format(stat, i) for i in range(3, 6)] + ['_Max' + stat]
+            stats += ['_Plus{}{}'.format(stat, i) for i in range(0, 5)] + ['_McFullBonus{}5'.format(stat)]
+        abilities = ['_Abilities{}{}'.format(i, j) for i in range(1, 4) for j in range(1, 5)]
+        columns = ['_BaseId', '_Name', '_SecondName', '_EmblemId', '_WeaponType', '_Rarity', '_ElementalType', '_CharaType',
+                   '_VariationId'] + stats + ['_MinDef', '_DefCoef', '_Skill1', '_Skill2'] + abilities + \
+            numbered('_ExAbilityData', 1, 6) + ['_ManaCircleName', '_CvInfo', '_CvInfoEn', '_ProfileText', '_IsPlayable',
+                                                '_MaxFriendshipPoint']
+        rows = []
+        for i in range(self.count('CharaData')):
+            cid = str(10000000 + i)
+            emblem = str(10000 + i)
+            self.label('EMBLEM_NAME_' + emblem)
+            self.label('EMBLEM_PHONETIC_' + emblem)
+            row = {'_Id': cid, '_BaseId': str(100000 + i), '_Name': self.label('CHARA_NAME_' + cid),
+                   '_SecondName': self.label('CHARA_NAME_COMMENT_' + cid), '_EmblemId': emblem,
+                   '_WeaponType': self.num(1, 8), '_Rarity': self.num(3, 5), '_ElementalType': self.num(1, 5),
+                   '_CharaType': self.num(1, 4), '_VariationId': '1', '_MinDef': '10', '_DefCoef': '8',
+                   '_Skill1': self.rng.choice(skill_ids), '_Skill2': self.rng.choice(skill_ids),
+                   '_ManaCircleName': 'MC_0' + self.num(400, 500), '_CvInfo': self.label('CV_INFO_' + cid),
+                   '_CvInfoEn': self.label('CV_INFO_EN_' + cid), '_ProfileText': self.label('CHARA_PROFILE_' + cid),
+                   '_IsPlayable': '1', '_MaxFriendshipPoint': '0'}
+            for k in stats + abilities + numbered('_ExAbilityData', 1, 6):
+                row[k] = self.num()
+            rows.append(row)
+        self.write_table('CharaData', columns, rows)
+
+    def dragon_data(self, skill_ids):
+        plain = ['_MinHp', '_MaxHp', '_MinAtk', '_MaxAtk', '_FavoriteType', '_SellCoin', '_SellDewPoint', '_MoveSpeed',
+                 '_DashSpeedRatio', '_TurnSpeed', '_IsTurnToDamageDir', '_MoveType', '_IsLongLange',
+                 '_Abilities11', '_Abilities12', '_Abilities21', '_Abilities22']
+        columns = ['_BaseId', '_Name', '_SecondName', '_EmblemId', '_Rarity', '_ElementalType', '_VariationId', '_IsPlayable',
+                   '_Skill1', '_Profile', '_CvInfo', '_CvInfoEn'] + plain
+        rows = []
+        for i in range(self.count('DragonData')):
+            did = str(20040000 + i)
+            emblem = str(20000 + i)
+            self.label('EMBLEM_NAME_' + emblem)
+            self.label('EMBLEM_PHONETIC_' + emblem)
+            row = {'_Id': did, '_BaseId': str(210000 + i), '_Name': self.label('DRAGON_NAME_' + did),
+                   '_SecondName': self.label('DRAGON_NAME_COMMENT_' + did), '_EmblemId': emblem,
+                   '_Rarity': self.num(3, 5), '_ElementalType': self.num(1, 5), '_VariationId': '1', '_IsPlayable': '1',
+                   '_Skill1': self.rng.choice(skill_ids), '_Profile': self.label('DRAGON_PROFILE_' + did),
+                   '_CvInfo': self.label('CV_INFO_' + did), '_CvInfoEn': self.label('CV_INFO_EN_' + did)}
+            for k in plain:
+                row[k] = self.num()
+            rows.append(row)
+        self.write_table('DragonData', columns, rows)
+
+    def ex_ability_data(self):
+        rows = []
+        for i in range(self.count('ExAbilityData')):
+            eid = str(100 + i)
+            rows.append({'_Id': eid, '_Name': self.label('EX_ABILITY_NAME_' + eid, '{} {} +{}%'.format(self.word(), self.word(), i % 20)),
+                         '_Details': self.label('EX_ABILITY_DETAIL_' + eid, 'Increases ' + self.word() + ' by {value1}%.'),
+                         '_AbilityType1UpValue0': self.num(1, 20), '_AbilityIconName': 'Icon_Ability_10' + eid,
+                         '_Category': self.num(1, 10), '_PartyPowerWeight': self.num()})
+        self.write_table('ExAbilityData', ['_Name', '_Details', '_AbilityType1UpValue0', '_AbilityIconName', '_Category',
+                                           '_PartyPowerWeight'], rows)
+
+    def emblem_data(self):
+        rows = []
+        for i in range(self.count('EmblemData')):
+            eid = str(30000 + i)
+            self.label('EMBLEM_NAME_' + eid)
+            self.label('EMBLEM_PHONETIC_' + eid)
+            text = 'A reward from the {} event.'.format(self.word()) if i % 3 == 0 else None
+            rows.append({'_Id': eid, '_Title': 'EMBLEM_NAME_' + eid, '_Rarity': self.num(1, 5),
+                         '_Gettext': self.label('EMBLEM_GETTEXT_' + eid, text)})
+        self.write_table('EmblemData', ['_Title', '_Rarity', '_Gettext'], rows)
+
+    def fort_plant_data(self):
+        plants = [str(100000 + i) for i in range(self.count('FortPlantData'))]
+        details = []
+        for i in range(self.count('FortPlantDetail')):
+            plant = plants[i % len(plants)]
+            level = i // len(plants) + 1
+            details.append({'_Id': str(100000000 + i), '_AssetGroup': plant, '_Level': str(level),
+                            '_ImageUiName': 'TW02_{}_IMG_{:02d}_01'.format(plant, (level + 1) // 4)})
+        self.write_table('FortPlantDetail', ['_AssetGroup', '_Level', '_ImageUiName'], details)
+        rows = [{'_Id': p, '_Name': self.label('FORT_PLANT_NAME_' + p), '_Description': self.label('FORT_PLANT_DETAIL_' + p),
+                 '_PlantSize': self.num(1, 4)} for p in plants]
+        self.write_table('FortPlantData', ['_Name', '_Description', '_PlantSize'], rows)
+
+    def mission_data(self):
+        entity_types = ('2', '4', '8', '10', '11', '14', '16', '17', '18', '23', '99')
+        for table in ('MissionDailyData', 'MissionPeriodData', 'MissionNormalData'):
+            rows = []
+            for i in range(self.count(table)):
+                mid = str(1000000 * len(table) + i)
+                entity_id = self.num(1, 500)
+                for prefix in ('USE_ITEM_NAME_', 'MATERIAL_NAME_', 'STAMP_NAME_', 'SUMMON_TICKET_NAME_'):
+                    self.label(prefix + entity_id)
+                rows.append({'_Id': mid, '_Text': self.label('MISSION_TEXT_' + mid),
+                             '_EntityType': self.rng.choice(entity_types), '_EntityId': entity_id,
+                             '_EntityQuantity': self.num(1, 100)})
+            self.write_table(table, ['_Text', '_EntityType', '_EntityId', '_EntityQuantity'], rows)
+
+    def quest_data(self):
+        prefixes = ('100', '201', '202', '203', '204', '208', '210', '211', '300', '999')
+        quests = []
+        for i in range(self.count('QuestData')):
+            qid = '{}{:06d}'.format(self.rng.choice(prefixes), i)
+            gid = qid[:6]
+            self.label('EVENT_NAME_' + gid)
+            view = '{}: {}'.format(self.word(), self.word()) if self.rng.random() < 0.5 else self.word()
+            quests.append({'_Id': qid, '_Gid': gid, '_QuestViewName': self.label('QUEST_NAME_' + qid, view),
+                           '_GroupType': self.num(1, 3), '_SectionName': self.label('QUEST_SECTION_' + qid),
+                           '_Elemental': self.num(0, 6), '_DifficultyLimit': self.rng.choice(('0', '0', '3000')),
+                           '_Difficulty': self.num(), '_SkipTicketCount': self.rng.choice(('1', '-1', '0')),
+                           '_PayStaminaSingle': self.num(0, 20), '_CampaignStaminaSingle': self.num(0, 20),
+                           '_PayStaminaMulti': self.num(0, 2), '_CampaignStaminaMulti': self.num(0, 2),
+                           '_ClearTermsType': self.num(1, 5), '_FailedTermsType': self.num(0, 6),
+                           '_FailedTermsTimeElapsed': self.rng.choice(('0', '180')), '_ContinueLimit': self.num(0, 3),
+                           '_ThumbnailImage': 'Quest_' + qid, '_AutoPlayType': self.num(0, 2)})
+        for i in range(1, 6):
+            self.label('QUEST_CLEAR_CONDITION_{}'.format(i))
+        for i in range(0, 6):
+            self.label('QUEST_FAILURE_CONDITON_{}'.format(i))
+        self.write_table('QuestData', ['_Gid', '_QuestViewName', '_GroupType', '_SectionName', '_Elemental',
+                                       '_DifficultyLimit', '_Difficulty', '_SkipTicketCount', '_PayStaminaSingle',
+                                       '_CampaignStaminaSingle', '_PayStaminaMulti', '_CampaignStaminaMulti',
+                                       '_ClearTermsType', '_FailedTermsType', '_FailedTermsTimeElapsed', '_ContinueLimit',
+                                       '_ThumbnailImage', '_AutoPlayType'], quests)
+
+        reward_columns = numbered('_FirstClearSetEntityType', 1, 6) + numbered('_FirstClearSetEntityId', 1, 6) + \
+            numbered('_FirstClearSetEntityQuantity', 1, 6) + numbered('_MissionCompleteType', 1, 4) + \
+            numbered('_MissionCompleteValues', 1, 4) + numbered('_MissionsClearSetEntityType', 1, 4) + \
+            numbered('_MissionsClearSetEntityQuantity', 1, 4) + ['_MissionCompleteEntityType', '_MissionCompleteEntityQuantity']
+        rewards = []
+        for quest in self.rng.sample(quests, min(len(quests), self.count('QuestRewardData'))):
+            row = {'_Id': quest['_Id']}
+            for k in reward_columns:
+                row[k] = self.num(0, 30)
+            for i in range(1, 6):
+                row['_FirstClearSetEntityType{}'.format(i)] = self.rng.choice(('0', '8', '20', '23'))
+            for i in range(1, 4):
+                row['_MissionCompleteType{}'.format(i)] = self.rng.choice(('0', '1', '15', '18'))
+                row['_MissionsClearSetEntityType{}'.format(i)] = self.rng.choice(('0', '8', '20', '23'))
+            rewards.append(row)
+        self.write_table('QuestRewardData', reward_columns, rewards)
+
+        bonuses = []
+        gids = sorted({q['_Gid'] for q in quests})
+        for i in range(self.count('QuestEvent')):
+            gid = self.rng.choice(gids) if self.rng.random() < 0.8 else str(900000 + i)
+            bonuses.append({'_Id': gid, '_QuestBonusType': self.num(0, 2), '_QuestBonusCount': self.num(1, 5)})
+        self.write_table('QuestEvent', ['_QuestBonusType', '_QuestBonusCount'], bonuses)
+
+    def weapon_data(self, skill_ids):
+        plain = ['_MinHp', '_MaxHp', '_MinAtk', '_MaxAtk', '_Abilities11', '_Abilities21', '_SellCoin', '_SellDewPoint']
+        weapons = []
+        for i in range(self.count('WeaponData')):
+            wid = str(301000000 + i)
+            row = {'_Id': wid, '_BaseId': str(301000 + i % 100), '_FormId': str(60000 + i),
+                   '_Name': self.label('WEAPON_NAME_' + wid), '_Type': self.num(1, 8), '_Rarity': self.num(1, 5),
+                   '_ElementalType': self.num(0, 6), '_Text': self.label('WEAPON_TEXT_' + wid),
+                   '_Skill': self.rng.choice(skill_ids) if self.rng.random() < 0.5 else '0'}
+            for k in plain:
+                row[k] = self.num()
+            weapons.append(row)
+        self.write_table('WeaponData', ['_BaseId', '_FormId', '_Name', '_Type', '_Rarity', '_ElementalType', '_Text', '_Skill'] +
+                         plain, weapons)
+
+        crafted = self.rng.sample(weapons, min(len(weapons), self.count('WeaponCraftTree')))
+        tree = [{'_Id': str(i + 1), '_CraftWeaponId': w['_Id'], '_CraftNodeId': self.num(1, 999),
+                 '_ParentCraftNodeId': self.num(0, 999), '_CraftGroupId': self.num(1, 50)} for i, w in enumerate(crafted)]
+        self.write_table('WeaponCraftTree', ['_CraftWeaponId', '_CraftNodeId', '_ParentCraftNodeId', '_CraftGroupId'], tree)
+
+        craft_columns = ['_FortCraftLevel', '_AssembleCoin', '_DisassembleCoin', '_MainWeaponId', '_MainWeaponQuantity'] + \
+            numbered('_CraftEntityType', 1, 6) + numbered('_CraftEntityId', 1, 6) + numbered('_CraftEntityQuantity', 1, 6)
+        craft = []
+        for w in self.rng.sample(weapons, min(len(weapons), self.count('WeaponCraftData'))):
+            row = {'_Id': w['_Id']}
+            for k in craft_columns:
+                row[k] = self.num(0, 200)
+            for i in range(1, 6):
+                row['_CraftEntityId{}'.format(i)] = self.num(100000000, 100000200)
+            craft.append(row)
+        self.write_table('WeaponCraftData', craft_columns, craft)
+
+def reset_pipeline(in_dir, ordering_data):
+    Process_DL_Data.in_dir = in_dir
+    Process_DL_Data.ORDERING_DATA = ordering_data
+    Process_DL_Data.WIKITEXT_FORMATTERS.clear()
+    Process_DL_Data.TEXT_LABEL_DICT.clear()
+    Process_DL_Data.FILE_HASHES.clear()
+    Process_DL_Data.TABLE_CACHE = Process_DL_Data.TableCache()
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def benchmark_labels(in_dir, index_dir):
+    timings = {}
+    for lang, label_name in (('en', Process_DL_Data.TEXT_LABEL), ('jp', Process_DL_Data.TEXT_LABEL_JP)):
+        path = in_dir + label_name + Process_DL_Data.EXT
+        if os.path.exists(index_dir):
+            rmtree(index_dir)
+        timings[label_name + '_build'], _ = timed(Process_DL_Data.load_text_label, path, index_dir)
+        timings[label_name], labels = timed(Process_DL_Data.load_text_label, path, index_dir)
+        Process_DL_Data.TEXT_LABEL_DICT[lang] = labels
+    skill_path = in_dir + Process_DL_Data.SKILL_DATA_NAME + Process_DL_Data.EXT
+    timings[Process_DL_Data.SKILL_DATA_NAME], Process_DL_Data.SKILL_DATA_NAMES = timed(
+        Process_DL_Data.csv_as_index, skill_path, None, '_Name')
+    return timings
+
+def benchmark_dataset(data_name, out_dir):
+    paths = [Process_DL_Data.in_dir + file_name + Process_DL_Data.EXT for file_name in Process_DL_Data.get_input_files(data_name)]
+    result = {'load': 0.0}
+    # tokenize the inputs into the table cache first so process only measures the parsers
+    for path in paths:
+        Process_DL_Data.TABLE_CACHE.expect(path, 2)
+        load_time, _ = timed(Process_DL_Data.TABLE_CACHE.read, path)
+        result['load'] += load_time
+    parser = Process_DL_Data.DataParser(data_name)
+    result['process'], _ = timed(parser.process)
+    result['emit'], _ = timed(parser.emit, out_dir)
+    result['rows'] = len(parser.row_data)
+    if parser.can_stream():
+        # what a real run does for this dataset, reading, processing and writing in one pass
+        parser = Process_DL_Data.DataParser(data_name)
+        result['stream'], _ = timed(parser.stream, out_dir)
+    return result
+
+def benchmark_scale(in_dir, out_dir, ordering_data, repeat):
+    best = None
+    for _ in range(repeat):
+        reset_pipeline(in_dir, ordering_data)
+        result = {'labels': benchmark_labels(in_dir, out_dir + '.label-index'), 'datasets': {}}
+        for data_name in Process_DL_Data.DATA_PARSER_PROCESSING:
+            result['datasets'][data_name] = benchmark_dataset(data_name, out_dir)
+        if best is None:
+            best = result
+            continue
+        # keep the fastest of each timing, repeated runs only add noise on top of it
+        for stage, seconds in result['labels'].items():
+            best['labels'][stage] = min(best['labels'][stage], seconds)
+        for data_name, timings in result['datasets'].items():
+            for stage, seconds in timings.items():
+                if stage != 'rows':
+                    best['datasets'][data_name][stage] = min(best['datasets'][data_name][stage], seconds)
+    return best
+
+def flatten_report(report):
+    timings = {}
+    for scale, result in report['scales'].items():
+        for stage, seconds in result['labels'].items():
+            timings['{}x/labels/{}'.format(scale, stage)] = seconds
+        for data_name, stages in result['datasets'].items():
+            for stage, seconds in stages.items():
+                if stage != 'rows':
+                    timings['{}x/{}/{}'.format(scale, data_name, stage)] = seconds
+    return timings
+
+def compare_reports(report, baseline, tolerance):
+    # returns (name, baseline seconds, current seconds) for every timing that got slower than tolerance allows
+    regressions = []
+    current = flatten_report(report)
+    for name, base_seconds in flatten_report(baseline).items():
+        if name not in current or max(base_seconds, current[name]) < MIN_COMPARE_TIME:
+            continue
+        if current[name] > base_seconds * tolerance:
+            regressions.append((name, base_seconds, current[name]))
+    return regressions
+
+def print_scale(scale, result):
+    print('\n{}x'.format(scale))
+    for stage, seconds in result['labels'].items():
+        print('  {:<28}{:>10.3f}s'.format(stage, seconds))
+    print('  {:<28}{:>10}{:>10}{:>10}{:>10}{:>10}'.format('dataset', 'rows', 'load', 'process', 'emit', 'stream'))
+    for data_name, stages in result['datasets'].items():
+        stream = '{:.3f}'.format(stages['stream']) if 'stream' in stages else '-'
+        print('  {:<28}{:>10}{:>10.3f}{:>10.3f}{:>10.3f}{:>10}'.format(
+            data_name, stages['rows'], stages['load'], stages['process'], stages['emit'], stream))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Process_DL_Data.py on synthetic master data.')
+    parser.add_argument('-s', type=str, help='comma separated scale factors (default: {})'.format(DEFAULT_SCALES), default=DEFAULT_SCALES)
+    parser.add_argument('-o', type=str, help='path of the json report (default: ./benchmark.json)', default='./benchmark.json')
+    parser.add_argument('-j', type=str, help='path to json file with ordering', default='')
+    parser.add_argument('-d', type=str, help='directory to keep the generated data in (default: a temporary directory)', default='')
+    parser.add_argument('--baseline', type=str, help='json report to compare against', default='')
+    parser.add_argument('--tolerance', type=float, help='slowdown factor that counts as a regression (default: 1.25)', default=1.25)
+    parser.add_argument('--repeat', type=int, help='runs per scale, the fastest of each timing is kept (default: 3)', default=3)
+    parser.add_argument('--seed', type=int, help='random seed of the generated data (default: 0)', default=0)
+
+    args = parser.parse_args()
+    ordering_data = {}
+    if args.j:
+        with open(args.j, 'r') as json_ordering_fp:
+            ordering_data = json.load(json_ordering_fp)
+    data_dir = args.d if args.d else tempfile.mkdtemp(prefix='dl-benchmark-')
+
+    report = {'python': platform.python_version(), 'seed': args.seed, 'scales': {}}
+    try:
+        for scale in args.s.split(','):
+            in_dir = '{}/{}x/in/'.format(data_dir, scale)
+            out_dir = '{}/{}x/out/'.format(data_dir, scale)
+            if not os.path.exists(in_dir):
+                print('Generating {}x data in {}'.format(scale, in_dir))
+                SyntheticMasterData(in_dir, scale=float(scale), seed=args.seed).generate()
+            if not os.path.exists(out_dir):
+                os.makedirs(out_dir)
+            report['scales'][scale] = benchmark_scale(in_dir, out_dir, ordering_data, args.repeat)
+            print_scale(scale, report['scales'][scale])
+    finally:
+        if not args.d:
+            rmtree(data_dir)
+
+    with open(args.o, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, indent=4)
+    print('\nSaved {}'.format(args.o))
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for name, base_seconds, seconds in regressions:
+            print('REGRESSION {}: {:.3f}s -> {:.3f}s'.format(name, base_seconds, seconds))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {}'.format(args.baseline))
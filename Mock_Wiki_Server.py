@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import random
+import secrets
+import time
+
+from aiohttp import web
+
+# just enough of the MediaWiki action API for Publish_DL_Data.py: tokens, login, revisions queries and edits
+SESSION_COOKIE = 'mockwiki_session'
+
+def normalize_title(title):
+    title = title.replace('_', ' ').strip()
+    return title[:1].upper() + title[1:]
+
+class MockWiki:
+    def __init__(self, user='', password='', fail_rate=0, rate_limit=0, latency=0, token_lifetime=0):
+        self.user = user
+        self.password = password
+        self.fail_rate = fail_rate
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+
+        self.pages = {}
+        self.sessions = {}
+        self.edit_times = []
+        self.stats = {'requests': 0, 'edits': 0, 'nochange': 0, 'failures': 0, 'rate_limited': 0, 'bad_tokens': 0}
+
+    def new_session(self):
+        session = {'login_token': secrets.token_hex(8) + '+\\', 'csrf_token': secrets.token_hex(8) + '+\\', 'edits': 0, 'user': None}
+        session_id = secrets.token_hex(16)
+        self.sessions[session_id] = session
+        return session_id, session
+
+    async def handle(self, request):
+        self.stats['requests'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.stats['failures'] += 1
+            return web.Response(status=503, text='Service temporarily unavailable')
+        params = dict(request.query)
+        if request.method == 'POST':
+            params.update(await request.post())
+
+        session_id = request.cookies.get(SESSION_COOKIE)
+        session = self.sessions.get(session_id)
+        if session is None:
+            session_id, session = self.new_session()
+        action = params.get('action')
+        if action == 'query':
+            result = self.query(session, params)
+        elif action == 'login':
+            result = self.login(session, params)
+        elif action == 'edit':
+            result = self.edit(session, params)
+        else:
+            result = {'error': {'code': 'badvalue', 'info': 'Unrecognized value for parameter "action": {}.'.format(action)}}
+        response = web.json_response(result)
+        response.set_cookie(SESSION_COOKIE, session_id)
+        return response
+
+    def query(self, session, params):
+        if params.get('meta') == 'tokens':
+            token_type = params.get('type', 'csrf')
+            return {'query': {'tokens': {token_type + 'token': session[token_type + '_token']}}}
+        if params.get('prop') == 'revisions':
+            normalized = []
+            pages = []
+            for title in params.get('titles', '').split('|'):
+                page_title = normalize_title(title)
+                if page_title != title:
+                    normalized.append({'from': title, 'to': page_title})
+                if page_title in self.pages:
+                    pages.append({'title': page_title, 'revisions': [{'slots': {'main': {'content': self.pages[page_title]}}}]})
+                else:
+                    pages.append({'title': page_title, 'missing': True})
+            return {'query': {'normalized': normalized, 'pages': pages}}
+        return {'error': {'code': 'badvalue', 'info': 'Unsupported query.'}}
+
+    def login(self, session, params):
+        if params.get('lgtoken') != session['login_token']:
+            return {'login': {'result': 'WrongToken'}}
+        if self.user and (params.get('lgname') != self.user or params.get('lgpassword') != self.password):
+            return {'login': {'result': 'Failed', 'reason': 'Incorrect username or password entered.'}}
+        session['user'] = params.get('lgname')
+        return {'login': {'result': 'Success', 'lgusername': session['user']}}
+
+    def edit(self, session, params):
+        if self.user and session['user'] is None:
+            return {'error': {'code': 'permissiondenied', 'info': 'You are not logged in.'}}
+        if params.get('token') != session['csrf_token']:
+            self.stats['bad_tokens'] += 1
+            return {'error': {'code': 'badtoken', 'info': 'Invalid CSRF token.'}}
+        if self.rate_limit:
+            now = time.monotonic()
+            self.edit_times = [t for t in self.edit_times if now - t < 1]
+            if len(self.edit_times) >= self.rate_limit:
+                self.stats['rate_limited'] += 1
+                return {'error': {'code': 'ratelimited', 'info': 'You\'ve exceeded your rate limit.'}}
+            self.edit_times.append(now)
+        # rotating the token makes clients go through their bad token handling
+        session['edits'] += 1
+        if self.token_lifetime and session['edits'] % self.token_lifetime == 0:
+            session['csrf_token'] = secrets.token_hex(8) + '+\\'
+        title = normalize_title(params.get('title', ''))
+        text = params.get('text', '').rstrip()
+        if self.pages.get(title) == text:
+            self.stats['nochange'] += 1
+            return {'edit': {'result': 'Success', 'title': title, 'nochange': True}}
+        self.pages[title] = text
+        self.stats['edits'] += 1
+        return {'edit': {'result': 'Success', 'title': title}}
+
+def make_app(wiki, dump=''):
+    app = web.Application()
+    app.router.add_route('*', '/api.php', wiki.handle)
+    async def report(app):
+        print('Served {requests} requests: {edits} edits, {nochange} unchanged, {failures} failures, '
+            '{rate_limited} rate limited, {bad_tokens} bad tokens'.format(**wiki.stats))
+        if dump:
+            with open(dump, 'w', encoding='utf-8') as dump_file:
+                json.dump(wiki.pages, dump_file, ensure_ascii=False, indent=4)
+            print('Saved {} pages to {}'.format(len(wiki.pages), dump))
+    app.on_cleanup.append(report)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local mock of the MediaWiki action API to try Publish_DL_Data.py against.')
+    parser.add_argument('--host', type=str, help='address to listen on (default: 127.0.0.1)', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='port to listen on (default: 8080)', default=8080)
+    parser.add_argument('--user', type=str, help='require a login with this user name', default='')
+    parser.add_argument('--password', type=str, help='password of --user', default='')
+    parser.add_argument('--fail_rate', type=float, help='fraction of requests answered with HTTP 503 (default: 0)', default=0)
+    parser.add_argument('--rate_limit', type=int, help='edits per second before answering ratelimited, 0 for no limit (default: 0)', default=0)
+    parser.add_argument('--latency', type=float, help='seconds added to every response (default: 0)', default=0)
+    parser.add_argument('--token_lifetime', type=int, help='edits before a session gets a new edit token, 0 to never rotate (default: 0)', default=0)
+    parser.add_argument('--dump', type=str, help='save the pages as json on shutdown', default='')
+
+    args = parser.parse_args()
+    wiki = MockWiki(args.user, args.password, args.fail_rate, args.rate_limit, args.latency, args.token_lifetime)
+    print('Mock wiki api at http://{}:{}/api.php'.format(args.host, args.port))
+    web.run_app(make_app(wiki, args.dump), host=args.host, port=args.port, print=None)
@@ -2,13 +2,29 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import cProfile
 import csv
+import hashlib
+import inspect
+import itertools
 import json
+import mmap
+import multiprocessing
 import os
+import pstats
 import re
+import sqlite3
 import string
+import struct
+import sys
+import time
+import traceback
+import tracemalloc
+import zlib
 
 from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from operator import itemgetter
 from shutil import copyfile, rmtree
 
 import pdb
@@ -25,11 +41,56 @@ EMBLEM_P = 'EMBLEM_PHONETIC_'
 TEXT_LABEL = 'TextLabel'
 TEXT_LABEL_JP = 'TextLabelJP'
 TEXT_LABEL_DICT = {}
+# primary label table of each --locales entry, swapped into TEXT_LABEL_DICT['en'] for that locale's pass
+LOCALE_LABELS = {}
+# every loaded label table by file name
+LABEL_TABLES = {}
+# label text to its compiled LabelTemplate
+LABEL_TEMPLATES = {}
+UNKNOWN_PLACEHOLDERS = set()
 
 SKILL_DATA_NAME = 'SkillData'
 SKILL_DATA_NAMES = None
 
 ORDERING_DATA = {}
+# (template, delim) to a row formatter compiled from ORDERING_DATA
+WIKITEXT_FORMATTERS = {}
+
+STREAM_BUFFER_SIZE = 1 << 16
+
+# seconds between polls of the input directory in --watch
+WATCH_INTERVAL = 0.2
+
+# set up by --profile and --cprofile
+PROFILER = None
+CPROFILE_DATASET = ''
+PROFILE_REPORT = '.profile.json'
+LABEL_PROFILE_NAME = '(labels)'
+
+MANIFEST = '.manifest.json'
+FILE_HASHES = {}
+
+# fingerprints of every entity written last run, and the added/changed/removed entities not published yet
+FINGERPRINT_DIR = '.fingerprints/'
+DELTA_DIR = 'delta/'
+FINGERPRINT_SIZE = 8
+
+# set up by --jsonl and --sqlite, processed rows are written next to the wikitext in the same pass
+EXPORT_FORMATS = set()
+JSONL_EXT = '.jsonl'
+SQLITE_DB = 'data.sqlite'
+SQLITE_TIMEOUT = 60
+SQLITE_BATCH_SIZE = 1000
+SQLITE_INDEX_KEYS = ('Id', 'BaseId')
+DATASET_COLUMN = '_Dataset'
+DISPLAY_NAME_COLUMN = '_DisplayName'
+
+# compiled label index: header, open addressing table of (crc32, offset) slots, then (key_len, value_len, key, value) entries
+LABEL_INDEX_EXT = '.idx'
+LABEL_INDEX_MAGIC = b'DLLBLIX1'
+LABEL_INDEX_HEADER = struct.Struct('<8sII')
+LABEL_INDEX_SLOT = struct.Struct('<II')
+LABEL_INDEX_ENTRY = struct.Struct('<II')
 
 ROMAN_NUMERALS = [None, 'I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X']
 ELEMENT_TYPE = [None, 'Flame', 'Water', 'Wind', 'Light', 'Shadow']
@@ -55,84 +116,722 @@ GROUP_TYPE_DICT = {
 MATERIAL_NAME_LABEL = 'MATERIAL_NAME_'
 EVENT_RAID_ITEM_LABEL = 'EV_RAID_ITEM_NAME_'
 
+# key tuple to its RowShape
+ROW_SHAPES = {}
+INTERN_MAX_LENGTH = 16
+
+class RowShape:
+    # key order shared by every Record built with the same keys, along with the shapes that adding a key leads to
+    def __init__(self, keys):
+        self.keys = keys
+        self.positions = {k: i for i, k in enumerate(keys)}
+        self.transitions = {}
+
+    def add_key(self, key):
+        try:
+            return self.transitions[key]
+        except KeyError:
+            shape = self.transitions[key] = get_row_shape(self.keys + (key,))
+            return shape
+
+    def plan(self, fields):
+        # positions of the (key, prefix) fields this shape has, in field order
+        return [(prefix, self.positions[k]) for k, prefix in fields if k in self.positions]
+
+def get_row_shape(keys):
+    try:
+        return ROW_SHAPES[keys]
+    except KeyError:
+        shape = ROW_SHAPES[keys] = RowShape(keys)
+        return shape
+
+class Record:
+    # compact mapping for rows kept in a RowStore, the keys live once in a shared RowShape and each row only holds its values
+    __slots__ = ('_shape', '_values')
+
+    def __init__(self, shape, values):
+        self._shape = shape
+        self._values = values
+
+    @classmethod
+    def from_dict(cls, row):
+        # short values like '0' repeat across most rows, keep one copy of each
+        intern = sys.intern
+        return cls(get_row_shape(tuple(row)),
+            [intern(v) if v.__class__ is str and len(v) <= INTERN_MAX_LENGTH else v for v in row.values()])
+
+    def layout(self):
+        return self._shape, self._values
+
+    def __getitem__(self, key):
+        return self._values[self._shape.positions[key]]
+
+    def __setitem__(self, key, value):
+        if value.__class__ is str and len(value) <= INTERN_MAX_LENGTH:
+            value = sys.intern(value)
+        position = self._shape.positions.get(key)
+        if position is None:
+            self._shape = self._shape.add_key(key)
+            self._values.append(value)
+        else:
+            self._values[position] = value
+
+    def __contains__(self, key):
+        return key in self._shape.positions
+
+    def get(self, key, default=None):
+        position = self._shape.positions.get(key)
+        return default if position is None else self._values[position]
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return self._shape.keys
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._shape.keys, self._values)
+
+class RowStore:
+    # ordered list of (display_name, row) with hash indexes on join keys
+    # each index maps a key value to the position of the first row that has it
+    # dict rows are kept as Records
+    def __init__(self, index_keys=()):
+        self.rows = []
+        self.indexes = {key: {} for key in index_keys}
+
+    def _index_row(self, position, row):
+        if row.__class__ is not Record:
+            return
+        for key, index in self.indexes.items():
+            if key in row:
+                index.setdefault(row[key], position)
+
+    def append(self, entry):
+        if isinstance(entry[1], dict):
+            entry = (entry[0], Record.from_dict(entry[1]))
+        self.rows.append(entry)
+        self._index_row(len(self.rows) - 1, entry[1])
+
+    def find(self, key, value):
+        # returns the position of the first row with row[key] == value, or None
+        try:
+            index = self.indexes[key]
+        except KeyError:
+            # not declared up front, build it once and keep it up to date from here on
+            index = self.indexes[key] = {}
+            for position, (_, row) in enumerate(self.rows):
+                if row.__class__ is Record and key in row:
+                    index.setdefault(row[key], position)
+        return index.get(value)
+
+    def __getitem__(self, position):
+        return self.rows[position]
+
+    def __setitem__(self, position, entry):
+        # join key values are not expected to change once a row is stored,
+        # so only keys that are new to the row get indexed here
+        if isinstance(entry[1], dict):
+            entry = (entry[0], Record.from_dict(entry[1]))
+        self.rows[position] = entry
+        self._index_row(position, entry[1])
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+def iter_table_rows(csvfile, reader, width):
+    with csvfile:
+        for values in reader:
+            if not values:
+                continue
+            if len(values) < width:
+                values += [None] * (width - len(values))
+            yield values
+
+def open_table(path, tabs=False):
+    # returns (header, rows) where rows lazily reads each row as a list of column values
+    csvfile = open(path, 'r', newline='', encoding='utf-8')
+    if tabs:
+        reader = csv.reader(csvfile, dialect='excel-tab')
+    else:
+        reader = csv.reader(csvfile)
+    header = next(reader)
+    return header, iter_table_rows(csvfile, reader, len(header))
+
+def read_table(path, tabs=False):
+    header, rows = open_table(path, tabs=tabs)
+    return header, list(rows)
+
+class TableCache:
+    # run-scoped cache of tokenized input files shared by csv_as_index and DataParser.process_csv
+    # a table is only kept while more reads of it are expected, then it is evicted
+    # the last read of a table that was never cached streams straight from the file
+    def __init__(self):
+        self.tables = {}
+        self.expected_reads = {}
+
+    def expect(self, path, count=1):
+        self.expected_reads[path] = self.expected_reads.get(path, 0) + count
+
+    def read(self, path, tabs=False):
+        table = self.tables.get(path)
+        remaining = self.expected_reads.get(path, 0) - 1
+        if remaining > 0:
+            if table is None:
+                table = read_table(path, tabs=tabs)
+            self.expected_reads[path] = remaining
+            self.tables[path] = table
+        else:
+            if table is None:
+                table = open_table(path, tabs=tabs)
+            self.expected_reads.pop(path, None)
+            self.tables.pop(path, None)
+        return table
+
+    def clear(self):
+        self.tables.clear()
+        self.expected_reads.clear()
+
+TABLE_CACHE = TableCache()
+
+class EntityDelta:
+    # compares the fingerprint of each written entity against the previous run, keeping the text of the ones that differ
+    def __init__(self, previous):
+        self.previous = previous
+        self.fingerprints = {}
+        self.keys = {}
+        self.added = {}
+        self.changed = {}
+
+    def add(self, display_name, row, text):
+        # rows are keyed by their Id so a renamed entity shows up as changed, the display name is kept for reading the delta
+        key = str(row['Id']) if isinstance(row, (dict, Record)) and 'Id' in row else display_name or ''
+        count = self.keys[key] = self.keys.get(key, 0) + 1
+        if count > 1:
+            key = '{} #{}'.format(key, count)
+        fingerprint = hashlib.blake2b(text.encode('utf-8'), digest_size=FINGERPRINT_SIZE).hexdigest()
+        self.fingerprints[key] = [display_name, fingerprint]
+        previous = self.previous.get(key)
+        if previous is None:
+            self.added[key] = {'name': display_name, 'text': text}
+        elif previous[1] != fingerprint:
+            self.changed[key] = {'name': display_name, 'text': text}
+
+    def removed(self):
+        return {key: previous[0] for key, previous in self.previous.items() if key not in self.fingerprints}
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed())
+
+def load_fingerprints(out_dir, data_name):
+    try:
+        with open(out_dir+FINGERPRINT_DIR+data_name+'.json', 'r', encoding='utf-8') as fingerprint_file:
+            return json.load(fingerprint_file)
+    except (OSError, ValueError):
+        return {}
+
+def load_delta(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as delta_file:
+            return json.load(delta_file)
+    except (OSError, ValueError):
+        return {'added': {}, 'changed': {}, 'removed': {}}
+
+def write_delta(path, pending):
+    # replaced in one step, Publish_DL_Data.py may be reading or claiming it meanwhile
+    if any(pending.values()):
+        with open(path+'.tmp', 'w', encoding='utf-8') as delta_file:
+            json.dump(pending, delta_file, ensure_ascii=False, indent=4)
+        os.replace(path+'.tmp', path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def merge_delta(pending, delta):
+    # folds the entities of a later delta into the ones not published yet
+    added, changed, removed = pending['added'], pending['changed'], pending['removed']
+    for key, entry in delta['added'].items():
+        # removed entities are left on the wiki, so coming back is a change to that page
+        if key in removed:
+            del removed[key]
+            changed[key] = entry
+        else:
+            added[key] = entry
+    for key, entry in delta['changed'].items():
+        (added if key in added else changed)[key] = entry
+    for key, name in delta['removed'].items():
+        # an entity added and removed again before publishing never made it to the wiki
+        if key in added:
+            del added[key]
+        else:
+            changed.pop(key, None)
+            removed[key] = name
+    return pending
+
+def save_delta(out_dir, data_name, delta):
+    # deltas build up over runs until Publish_DL_Data.py has published them, the fingerprints are always refreshed
+    if delta:
+        path = out_dir+DELTA_DIR+data_name+'.json'
+        write_delta(path, merge_delta(load_delta(path), {'added': delta.added, 'changed': delta.changed, 'removed': delta.removed()}))
+    with open(out_dir+FINGERPRINT_DIR+data_name+'.json', 'w', encoding='utf-8') as fingerprint_file:
+        json.dump(delta.fingerprints, fingerprint_file)
+
+class RowExporter:
+    # one table per template, shared by every dataset using it, so each dataset's rows are tagged with its name
+    def __init__(self, data_name, template, out_dir, formats):
+        self.data_name = data_name
+        self.table = template
+        self.jsonl_file = None
+        self.db = None
+        if 'jsonl' in formats:
+            self.jsonl_file = open(out_dir+data_name+JSONL_EXT, 'w', encoding='utf-8', buffering=STREAM_BUFFER_SIZE)
+        if 'sqlite' in formats:
+            # parallel workers take turns on the write lock, batches keep each turn short
+            self.db = sqlite3.connect(out_dir+SQLITE_DB, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            self.columns = None
+            self.batch = []
+            self.write_batch(clear=True)
+
+    def append(self, display_name, row):
+        if isinstance(row, list):
+            row = OrderedDict(('Value{}'.format(i), v) for i, v in enumerate(row, start=1))
+        if self.jsonl_file is not None:
+            record = {DISPLAY_NAME_COLUMN: display_name} if display_name else {}
+            record.update(row)
+            self.jsonl_file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        if self.db is not None:
+            self.batch.append((display_name, row))
+            if len(self.batch) >= SQLITE_BATCH_SIZE:
+                self.write_batch()
+
+    def write_batch(self, clear=False):
+        db = self.db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('CREATE TABLE IF NOT EXISTS "{}" ("{}" TEXT, "{}" TEXT)'.format(self.table, DATASET_COLUMN, DISPLAY_NAME_COLUMN))
+            db.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ("{1}")'.format(self.table, DATASET_COLUMN))
+            if clear:
+                db.execute('DELETE FROM "{}" WHERE "{}" = ?'.format(self.table, DATASET_COLUMN), (self.data_name,))
+            # another worker may have added columns since this one last looked
+            self.columns = {info[1] for info in db.execute('PRAGMA table_info("{}")'.format(self.table))}
+            for _, row in self.batch:
+                for k in row:
+                    if k not in self.columns:
+                        db.execute('ALTER TABLE "{}" ADD COLUMN "{}"'.format(self.table, k))
+                        if k in SQLITE_INDEX_KEYS:
+                            db.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ("{1}")'.format(self.table, k))
+                        self.columns.add(k)
+            for display_name, row in self.batch:
+                names = [DATASET_COLUMN, DISPLAY_NAME_COLUMN] + list(row)
+                values = [self.data_name, display_name] + [v if v is None or isinstance(v, (int, float, str)) else str(v) for v in row.values()]
+                db.execute('INSERT INTO "{}" ({}) VALUES ({})'.format(
+                    self.table, ', '.join('"{}"'.format(k) for k in names), ', '.join('?' * len(names))), values)
+            db.execute('COMMIT')
+        except:
+            db.execute('ROLLBACK')
+            raise
+        self.batch = []
+
+    def close(self):
+        if self.jsonl_file is not None:
+            self.jsonl_file.close()
+        if self.db is not None:
+            if self.batch:
+                self.write_batch()
+            self.db.close()
+
+class RowWriter:
+    # stands in for the RowStore of parsers with no later joins, rows are written out as soon as they are added
+    def __init__(self, out_file, formatter, template, delta=None, export=None):
+        self.out_file = out_file
+        self.formatter = formatter
+        self.template = template
+        self.delta = delta
+        self.export = export
+
+        self.count = 0
+
+    def append(self, entry):
+        display_name, row = entry
+        text = self.formatter(row, self.template, display_name)
+        self.out_file.write(text)
+        if self.delta is not None:
+            self.delta.add(display_name, row, text)
+        if self.export is not None:
+            self.export.append(display_name, row)
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+class PipelineProfiler:
+    # wall time, rows, peak memory and label lookups per process_info stage, only collected with --profile
+    def __init__(self):
+        self.datasets = {}
+        self.current = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, data_name, stage_name):
+        stats = {'wall': 0.0, 'rows': 0, 'rows_per_second': 0.0, 'peak_memory': 0, 'label_lookups': 0, 'label_misses': 0}
+        self.datasets.setdefault(data_name, {})[stage_name] = stats
+        self.current = stats
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats['wall'] = time.perf_counter() - start
+            stats['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            if stats['wall'] > 0:
+                stats['rows_per_second'] = stats['rows'] / stats['wall']
+            self.current = None
+
+    def count_label(self, found):
+        if self.current is not None:
+            self.current['label_lookups'] += 1
+            if not found:
+                self.current['label_misses'] += 1
+
+    def summarize(self, data_name, wall, rows):
+        stages = self.datasets.pop(data_name, {})
+        return {
+            'wall': wall,
+            'rows': rows,
+            'rows_per_second': rows / wall if wall > 0 else 0.0,
+            'peak_memory': max([stats['peak_memory'] for stats in stages.values()], default=0),
+            'label_lookups': sum(stats['label_lookups'] for stats in stages.values()),
+            'label_misses': sum(stats['label_misses'] for stats in stages.values()),
+            'stages': stages,
+        }
+
+def profile_stage(data_name, stage_name):
+    if PROFILER is None:
+        return nullcontext()
+    return PROFILER.stage(data_name, stage_name)
+
 class DataParser:
-    def __init__(self, _data_name, _template, _formatter, _process_info):
+    def __init__(self, _data_name):
         self.data_name = _data_name
-        self.template = _template
-        self.formatter = _formatter
-        self.process_info = _process_info
-        self.row_data = []
+        self.spec = DATA_PARSERS[_data_name]
+        self.template = self.spec.template
+        self.formatter = self.spec.formatter
+        self.row_data = RowStore(self.spec.join_keys)
         self.extra_data = {}
-
-    def process_csv(self, file_name, func):
-        with open(in_dir+file_name+EXT, 'r', newline='', encoding='utf-8') as in_file:
-            reader = csv.DictReader(in_file)
-            for row in reader:
-                if row[ROW_INDEX] == '0':
+        self.delta = None
+        self.export = None
+
+    def process_csv(self, stage):
+        with profile_stage(self.data_name, stage.file_name) as stats:
+            header, rows = TABLE_CACHE.read(in_dir+stage.file_name+EXT)
+            id_index = header.index(ROW_INDEX)
+            # missing columns are left out of the row, so process_* KeyError fallbacks still apply
+            names, project, missing = column_projection(header, stage.columns)
+            func = stage.func
+            args = (self.row_data, self.extra_data)[:stage.arity - 1]
+            row_count = 0
+            for values in rows:
+                if values[id_index] == '0':
                     continue
+                row_count += 1
+                row = dict(zip(names, project(values)))
                 try:
-                    func(row, self.row_data)
-                except TypeError:
-                    func(row, self.row_data, self.extra_data)
+                    func(row, *args)
+                except KeyError as e:
+                    if e.args and e.args[0] in missing:
+                        raise KeyError('{}{} has no column {}'.format(stage.file_name, EXT, e.args[0])) from e
+                    raise
                 # except Exception as e:
                 #     print('Error processing {}: {}'.format(file_name, str(e)))
+            if stats is not None:
+                stats['rows'] = row_count
 
     def process(self):
-        try: # process_info is an iteratable of (file_name, process_function)
-            for file_name, func in self.process_info:
-                self.process_csv(file_name, func)
-        except TypeError: # process_info is the process_function
-            self.process_csv(self.data_name, self.process_info)
+        for stage in self.spec.stages:
+            self.process_csv(stage)
 
     def emit(self, out_dir):
-        with open(out_dir+self.data_name+EXT, 'w', newline='', encoding='utf-8') as out_file:
-            for display_name, row in self.row_data:
-                out_file.write(self.formatter(row, self.template, display_name))
-
-def csv_as_index(path, index=None, value_key=None, tabs=False):
-    with open(path, 'r', newline='', encoding='utf-8') as csvfile:
-        if tabs:
-            reader = csv.DictReader(csvfile, dialect='excel-tab')
-        else:
-            reader = csv.DictReader(csvfile)
-        first_row = next(reader)
-        key_iter = iter(first_row.keys())
-        csvfile.seek(0)
-        if not index:
-            index = next(key_iter) # get first key as index
-        if len(first_row) == 2:
-            # load 2 column files as dict[string] = string
-            value_key = next(key_iter) # get second key
-        if value_key:
-            return {row[index]: row[value_key] for row in reader if row[index] != '0'}
-        else:
-            # load >2 column files as a dict[string] = OrderedDict
-            return {row[index]: row for row in reader if row[index] != '0'}
+        with profile_stage(self.data_name, 'emit') as stats, \
+                open(out_dir+self.data_name+EXT, 'w', newline='', encoding='utf-8') as out_file:
+            writer = RowWriter(out_file, self.formatter, self.template, self.delta, self.export)
+            for entry in self.row_data:
+                writer.append(entry)
+            if stats is not None:
+                stats['rows'] = len(self.row_data)
+
+    def can_stream(self):
+        return self.spec.streamable
+
+    def stream(self, out_dir):
+        # process and emit in one pass without keeping the rows around
+        with open(out_dir+self.data_name+EXT, 'w', newline='', encoding='utf-8', buffering=STREAM_BUFFER_SIZE) as out_file:
+            self.row_data = RowWriter(out_file, self.formatter, self.template, self.delta, self.export)
+            self.process()
+
+def csv_as_index(path, index=None, value_key=None, tabs=False, columns=None):
+    header, rows = TABLE_CACHE.read(path, tabs=tabs)
+    if not index:
+        index = header[0] # get first key as index
+    if len(header) == 2:
+        # load 2 column files as dict[string] = string
+        value_key = header[1] # get second key
+    index_pos = header.index(index)
+    if value_key:
+        value_pos = header.index(value_key)
+        return {row[index_pos]: row[value_pos] for row in rows if row[index_pos] != '0'}
+    else:
+        # load >2 column files as a dict[string] = dict, optionally with only the given columns
+        names, project, _ = column_projection(header, columns)
+        return {row[index_pos]: dict(zip(names, project(row))) for row in rows if row[index_pos] != '0'}
+
+class LabelIndex:
+    # read-only mapping of label key to text, looked up directly in a memory-mapped compiled index
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as index_file:
+            self.data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, slot_count, self.count = LABEL_INDEX_HEADER.unpack_from(self.data, 0)
+        if magic != LABEL_INDEX_MAGIC:
+            raise ValueError('{} is not a label index'.format(path))
+        self.mask = slot_count - 1
+
+    @staticmethod
+    def build(labels, path):
+        slot_count = 2
+        while slot_count < len(labels) * 2:
+            slot_count *= 2
+        mask = slot_count - 1
+        entry_start = LABEL_INDEX_HEADER.size + slot_count * LABEL_INDEX_SLOT.size
+        slots = bytearray(slot_count * LABEL_INDEX_SLOT.size)
+        entries = bytearray()
+        for key, value in labels.items():
+            key_bytes, value_bytes = key.encode('utf-8'), value.encode('utf-8')
+            key_hash = zlib.crc32(key_bytes)
+            slot = key_hash & mask
+            while LABEL_INDEX_SLOT.unpack_from(slots, slot * LABEL_INDEX_SLOT.size)[1] != 0:
+                slot = (slot + 1) & mask
+            LABEL_INDEX_SLOT.pack_into(slots, slot * LABEL_INDEX_SLOT.size, key_hash, entry_start + len(entries))
+            entries += LABEL_INDEX_ENTRY.pack(len(key_bytes), len(value_bytes)) + key_bytes + value_bytes
+        # write to a temporary name first so concurrent runs never see a partial index
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as index_file:
+            index_file.write(LABEL_INDEX_HEADER.pack(LABEL_INDEX_MAGIC, slot_count, len(labels)))
+            index_file.write(slots)
+            index_file.write(entries)
+        os.replace(tmp_path, path)
+
+    def get(self, key, default=None):
+        key_bytes = key.encode('utf-8')
+        key_hash = zlib.crc32(key_bytes)
+        data = self.data
+        slot = key_hash & self.mask
+        while True:
+            slot_hash, offset = LABEL_INDEX_SLOT.unpack_from(data, LABEL_INDEX_HEADER.size + slot * LABEL_INDEX_SLOT.size)
+            if offset == 0:
+                return default
+            if slot_hash == key_hash:
+                key_len, value_len = LABEL_INDEX_ENTRY.unpack_from(data, offset)
+                start = offset + LABEL_INDEX_ENTRY.size
+                if data[start:start+key_len] == key_bytes:
+                    return data[start+key_len:start+key_len+value_len].decode('utf-8')
+            slot = (slot + 1) & self.mask
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.close()
+
+    # mmaps can't be pickled, spawned workers reopen the index file instead
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+def close_label_table(label_file):
+    # an index file can't be removed on Windows while it is mapped, and the mapping is never needed again
+    table = LABEL_TABLES.pop(label_file, None)
+    if isinstance(table, LabelIndex):
+        for tables in (TEXT_LABEL_DICT, LOCALE_LABELS):
+            for key in [key for key, value in tables.items() if value is table]:
+                del tables[key]
+        table.close()
+
+def load_text_label(path, index_dir):
+    # labels are compiled into an index once per label file hash, with newlines already normalized
+    digest = file_hash(path)
+    if digest is None:
+        raise FileNotFoundError(path)
+    label_name = os.path.splitext(os.path.basename(path))[0]
+    index_path = os.path.join(index_dir, '{}.{}{}'.format(label_name, digest, LABEL_INDEX_EXT))
+    try:
+        return LabelIndex(index_path)
+    except (OSError, ValueError):
+        pass
+    labels = {key: text.replace('\\n', ' ') for key, text in csv_as_index(path, tabs=True).items()}
+    try:
+        os.makedirs(index_dir, exist_ok=True)
+        LabelIndex.build(labels, index_path)
+    except OSError as e:
+        print('Could not save label index {}: {}'.format(index_path, e))
+        return labels
+    # drop indexes built for older versions of this label file, another process may still have one open
+    close_label_table(label_name)
+    for f in os.listdir(index_dir):
+        if f.startswith(label_name + '.') and f.endswith(LABEL_INDEX_EXT) and f.count('.') == 2 \
+                and os.path.join(index_dir, f) != index_path:
+            try:
+                os.remove(os.path.join(index_dir, f))
+            except OSError:
+                pass
+    return LabelIndex(index_path)
 
 def get_label(key, lang='en'):
     try:
         txt_label = TEXT_LABEL_DICT[lang]
     except KeyError:
         txt_label = TEXT_LABEL_DICT['en']
-    return txt_label[key].replace('\\n', ' ') if key in txt_label else DEFAULT_TEXT_LABEL
+    label = txt_label.get(key)
+    if PROFILER is not None:
+        PROFILER.count_label(label is not None)
+    return DEFAULT_TEXT_LABEL if label is None else label
+
+class LabelTemplate:
+    # a label split once into its literal text and named placeholders, placeholders missing from the parameters are left as is
+    CONVERSIONS = {'s': str, 'r': repr, 'a': ascii}
+
+    def __init__(self, text):
+        self.parts = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError:
+            # stray braces, str.format would raise on these as well
+            parsed = [(text, None, None, None)]
+        for literal, name, spec, conversion in parsed:
+            if literal:
+                self.parts.append(literal)
+            if name is not None:
+                source = '{' + name + ('!' + conversion if conversion else '') + (':' + spec if spec else '') + '}'
+                self.parts.append((name, self.CONVERSIONS.get(conversion), spec, source))
+        self.fields = {part[0] for part in self.parts if part.__class__ is tuple}
+        self.text = ''.join(self.parts) if not self.fields else None
+
+    def render(self, params, key=''):
+        if self.text is not None:
+            return self.text
+        out = []
+        for part in self.parts:
+            if part.__class__ is str:
+                out.append(part)
+                continue
+            name, conversion, spec, source = part
+            try:
+                value = params[name]
+            except KeyError:
+                report_unknown_placeholder(key, source)
+                out.append(source)
+                continue
+            if conversion is not None:
+                value = conversion(value)
+            out.append(format(value, spec))
+        return ''.join(out)
+
+def report_unknown_placeholder(key, source):
+    if (key, source) not in UNKNOWN_PLACEHOLDERS:
+        UNKNOWN_PLACEHOLDERS.add((key, source))
+        print('Unknown placeholder {} in label {}, left as is'.format(source, key))
+
+def get_label_template(key, lang='en'):
+    # compiled by label text, so the same label in other locales or a reloaded label table never shares a template
+    text = get_label(key, lang)
+    try:
+        return LABEL_TEMPLATES[text]
+    except KeyError:
+        template = LABEL_TEMPLATES[text] = LabelTemplate(text)
+        return template
+
+def format_label(key, lang='en', **params):
+    return get_label_template(key, lang).render(params, key)
 
 def get_jp_epithet(emblem_id):
     if 'jp' in TEXT_LABEL_DICT:
         return '{{' + 'Ruby|{}|{}'.format(get_label(EMBLEM_N + emblem_id, lang='jp'), get_label(EMBLEM_P + emblem_id, lang='jp')) + '}}'
     return ''
 
+def columns(*names):
+    # declares the input columns a process_* function reads, the reader only keeps these in each row
+    # process_* functions without a declaration get every column
+    def declare(func):
+        func.columns = (ROW_INDEX,) + names
+        return func
+    return declare
+
+def uses_tables(*names):
+    # declares the shared tables besides TextLabel that a process_* function reads (TextLabelJP, SkillData)
+    def declare(func):
+        func.tables = names
+        return func
+    return declare
+
+def joins(*keys):
+    # declares that a process_* function goes back to rows stored by earlier stages, found by these keys
+    # datasets with no joins are streamed straight to the output file
+    def declare(func):
+        func.joins = keys
+        return func
+    return declare
+
+def numbered_columns(name_format, *ranges):
+    # numbered_columns('_Abilities{}{}', range(1, 3), range(1, 3)) -> _Abilities11, _Abilities12, _Abilities21, _Abilities22
+    return tuple(name_format.format(*numbers) for numbers in itertools.product(*ranges))
+
+def column_projection(header, names=None):
+    # returns (names kept, function that picks their values out of a row, declared names missing from the header)
+    if names is None:
+        return header, lambda values: values, ()
+    positions = {name: i for i, name in enumerate(header)}
+    kept = tuple(name for name in names if name in positions)
+    missing = tuple(name for name in names if name not in positions)
+    if len(kept) == 1:
+        position = positions[kept[0]]
+        return kept, lambda values: (values[position],), missing
+    return kept, itemgetter(*(positions[name] for name in kept)), missing
+
 # All process_* functions take in 1 parameter (OrderedDict row) and return 3 values (OrderedDict new_row, str template_name, str display_name)
 # Make sure the keys are added to the OrderedDict in the desired output order
 def process_AbilityLimitedGroup(row, existing_data):
     new_row = OrderedDict()
     for k, v in row.items():
         new_row[k.strip('_')] = v
-    new_row['AbilityLimitedText'] = get_label(row['_AbilityLimitedText']).format(ability_limit0=row['_MaxLimitedValue'])
+    new_row['AbilityLimitedText'] = format_label(row['_AbilityLimitedText'], ability_limit0=row['_MaxLimitedValue'])
     existing_data.append((None, new_row))
 
 def process_AbilityShiftGroup(row, existing_data, ability_shift_groups):
     ability_shift_groups[row[ROW_INDEX]] = row
 
+@columns('_PartyPowerWeight', '_ShiftGroupId', '_AbilityType1UpValue', '_Name', '_Details', '_ElementalType',
+         '_ConditionValue', '_AbilityIconName', '_ViewAbilityGroupId1', *numbered_columns('_AbilityLimitedGroupId{}', range(1, 4)))
 def process_AbilityData(row, existing_data, ability_shift_groups):
     new_row = OrderedDict()
 
@@ -152,20 +851,20 @@ def process_AbilityData(row, existing_data, ability_shift_groups):
 
     # TODO: figure out what actually goes to {ability_val0}
     ability_value = EDIT_THIS if row['_AbilityType1UpValue'] == '0' else row['_AbilityType1UpValue']
-    new_row['Name'] = get_label(row['_Name']).format(
+    new_row['Name'] = format_label(row['_Name'],
         ability_shift0  =   ROMAN_NUMERALS[shift_value], # heck
         ability_val0    =   ability_value)
 
     # _ElementalType seems unreliable, use (element) in _Name for now
-    detail_label = get_label(row['_Details'])
-    if '{element_owner}' in detail_label and ')' in new_row['Name']:
+    detail_template = get_label_template(row['_Details'])
+    if 'element_owner' in detail_template.fields and ')' in new_row['Name']:
         element = new_row['Name'][1:new_row['Name'].index(')')]
     else:
         element = ELEMENT_TYPE[int(row['_ElementalType'])]
-    new_row['Details'] = detail_label.format(
-        ability_cond0   =   row['_ConditionValue'],
-        ability_val0    =   ability_value,
-        element_owner   =   element)
+    new_row['Details'] = detail_template.render({
+        'ability_cond0' :   row['_ConditionValue'],
+        'ability_val0'  :   ability_value,
+        'element_owner' :   element}, row['_Details'])
 
     new_row['AbilityIconName'] = row['_AbilityIconName']
     new_row['AbilityGroup'] = row['_ViewAbilityGroupId1']
@@ -174,6 +873,10 @@ def process_AbilityData(row, existing_data, ability_shift_groups):
     new_row['AbilityLimitedGroupId3'] = row['_AbilityLimitedGroupId3']
     existing_data.append((new_row['Name'], new_row))
 
+@uses_tables(TEXT_LABEL_JP)
+@columns('_BaseId', '_Name', '_Rarity', '_AmuletType', '_MinHp', '_MaxHp', '_MinAtk', '_MaxAtk', '_VariationId',
+         *numbered_columns('_Abilities{}{}', range(1, 4), range(1, 4)), *numbered_columns('_Text{}', range(1, 6)),
+         '_IsPlayable', '_SellCoin', '_SellDewPoint')
 def process_AmuletData(row, existing_data):
     ABILITY_COUNT = 3
     FLAVOR_COUNT = 5
@@ -209,6 +912,8 @@ def process_AmuletData(row, existing_data):
 
     existing_data.append((new_row['Name'], new_row))
 
+@columns('_Name', '_Detail', '_MaterialRarity', '_EventId', '_RaidEventId', '_QuestEventId', '_Category', '_SortId',
+         '_Description', *numbered_columns('_MoveQuest{}', range(1, 6)), '_PouchRarity', '_Exp')
 def process_Material(row, existing_data):
     new_row = OrderedDict()
 
@@ -246,6 +951,13 @@ def process_Material(row, existing_data):
 
     existing_data.append((new_row['Name'], new_row))
 
+@uses_tables(TEXT_LABEL_JP, SKILL_DATA_NAME)
+@columns('_BaseId', '_Name', '_SecondName', '_EmblemId', '_WeaponType', '_Rarity', '_ElementalType', '_CharaType',
+         '_VariationId', *numbered_columns('_Min{}{}', ('Hp', 'Atk'), range(3, 6)), '_MaxHp', '_MaxAtk',
+         *numbered_columns('_Plus{}{}', ('Hp', 'Atk'), range(0, 5)), '_McFullBonusHp5', '_McFullBonusAtk5', '_MinDef', '_DefCoef',
+         '_Skill1', '_Skill2', *numbered_columns('_Abilities{}{}', range(1, 4), range(1, 5)),
+         *numbered_columns('_ExAbilityData{}', range(1, 6)), '_ManaCircleName', '_CvInfo', '_CvInfoEn', '_ProfileText',
+         '_IsPlayable', '_MaxFriendshipPoint')
 def process_CharaData(row, existing_data):
     new_row = OrderedDict()
 
@@ -301,6 +1013,8 @@ def process_CharaData(row, existing_data):
 
     existing_data.append((new_row['Name'] + ' - ' + new_row['FullName'], new_row))
 
+@columns('_Name')
+@joins()
 def process_SkillDataNames(row, existing_data):
     for idx, (name, chara) in enumerate(existing_data):
         for i in (1, 2):
@@ -309,6 +1023,11 @@ def process_SkillDataNames(row, existing_data):
                 chara[sn_k] = get_label(row['_Name'])
                 existing_data[idx] = (name, chara)
 
+@uses_tables(TEXT_LABEL_JP, SKILL_DATA_NAME)
+@columns('_BaseId', '_Name', '_SecondName', '_EmblemId', '_Rarity', '_ElementalType', '_VariationId', '_IsPlayable',
+         '_MinHp', '_MaxHp', '_MinAtk', '_MaxAtk', '_Skill1', *numbered_columns('_Abilities{}{}', (1, 2), (1, 2)), '_Profile',
+         '_FavoriteType', '_CvInfo', '_CvInfoEn', '_SellCoin', '_SellDewPoint', '_MoveSpeed', '_DashSpeedRatio', '_TurnSpeed',
+         '_IsTurnToDamageDir', '_MoveType', '_IsLongLange')
 def process_Dragon(row, existing_data):
     new_row = OrderedDict()
 
@@ -351,6 +1070,7 @@ def process_Dragon(row, existing_data):
     new_row['AttackModifiers'] = '\n{{DragonAttackModifierRow|Combo 1|<EDIT_THIS>%|<EDIT_THIS>}}\n{{DragonAttackModifierRow|Combo 2|<EDIT_THIS>%|<EDIT_THIS>}}\n{{DragonAttackModifierRow|Combo 3|<EDIT_THIS>%|<EDIT_THIS>}}'
     existing_data.append((new_row['Name'], new_row))
 
+@columns('_Name', '_Details', '_AbilityType1UpValue0', '_AbilityIconName', '_Category', '_PartyPowerWeight')
 def process_ExAbilityData(row, existing_data):
     new_row = OrderedDict()
 
@@ -358,7 +1078,7 @@ def process_ExAbilityData(row, existing_data):
     new_row['Name'] = get_label(row['_Name'])
     # guess the generic name by chopping off the last word, which is usually +n% or V
     new_row['GenericName'] = new_row['Name'][0:new_row['Name'].rfind(' ')]
-    new_row['Details'] = get_label(row['_Details']).format(
+    new_row['Details'] = format_label(row['_Details'],
         value1=row['_AbilityType1UpValue0']
     )
     new_row['AbilityIconName'] = row['_AbilityIconName']
@@ -368,6 +1088,8 @@ def process_ExAbilityData(row, existing_data):
     existing_data.append((new_row['Name'], new_row))
 
 event_emblem_pattern = re.compile(r'^A reward from the ([A-Z].*?) event.$')
+@uses_tables(TEXT_LABEL_JP)
+@columns('_Title', '_Rarity', '_Gettext')
 def process_EmblemData(row, existing_data):
     new_row = OrderedDict()
 
@@ -381,12 +1103,14 @@ def process_EmblemData(row, existing_data):
 
     existing_data.append((new_row['Title'], new_row))
 
+@columns('_AssetGroup', '_Level', '_ImageUiName')
 def process_FortPlantDetail(row, existing_data, fort_plant_detail):
     try:
         fort_plant_detail[row['_AssetGroup']].append(row)
     except KeyError:
         fort_plant_detail[row['_AssetGroup']] = [row]
 
+@columns('_Name', '_Description', '_PlantSize')
 def process_FortPlantData(row, existing_data, fort_plant_detail):
     new_row = OrderedDict()
 
@@ -417,6 +1141,8 @@ def process_FortPlantData(row, existing_data, fort_plant_detail):
     new_row['UpgradeTable'] = ''
     existing_data.append((new_row['Name'], new_row))
 
+@columns('_Name', *numbered_columns('_SkillLv{}IconName', range(1, 4)), *numbered_columns('_Description{}', range(1, 4)),
+         '_Sp', '_SpLv2', '_IsAffectedByTension', '_ZoominTime', '_Zoom2Time', '_ZoomWaitTime')
 def process_SkillData(row, existing_data):
     new_row = OrderedDict()
 
@@ -439,6 +1165,7 @@ def process_SkillData(row, existing_data):
 
     existing_data.append((new_row['Name'], new_row))
 
+@columns('_Text', '_EntityType', '_EntityId', '_EntityQuantity')
 def process_MissionData(row, existing_data):
     entity_type_dict = {
         "2" : [get_label("USE_ITEM_NAME_" + row['_EntityId']),
@@ -466,6 +1193,9 @@ def process_MissionData(row, existing_data):
 
     existing_data.append((new_row[0], new_row))
 
+@columns('_Gid', '_QuestViewName', '_GroupType', '_SectionName', '_Elemental', '_DifficultyLimit', '_Difficulty',
+         '_SkipTicketCount', '_PayStaminaSingle', '_CampaignStaminaSingle', '_PayStaminaMulti', '_CampaignStaminaMulti',
+         '_ClearTermsType', '_FailedTermsType', '_FailedTermsTimeElapsed', '_ContinueLimit', '_ThumbnailImage', '_AutoPlayType')
 def process_QuestData(row, existing_data):
     new_row = {}
     for quest_type_id_check,quest_type in QUEST_TYPE_DICT.items():
@@ -527,18 +1257,21 @@ def process_QuestData(row, existing_data):
 
     existing_data.append((new_row['QuestViewName'], new_row))
 
+@joins('Id')
+@columns(*numbered_columns('_FirstClearSetEntityType{}', range(1, 6)), '_FirstClearSetEntityId1',
+         '_FirstClearSetEntityQuantity1', *numbered_columns('_MissionCompleteType{}', range(1, 4)),
+         *numbered_columns('_MissionCompleteValues{}', range(1, 4)), *numbered_columns('_MissionsClearSetEntityType{}', range(1, 4)),
+         *numbered_columns('_MissionsClearSetEntityQuantity{}', range(1, 4)), '_MissionCompleteEntityType',
+         '_MissionCompleteEntityQuantity')
 def process_QuestRewardData(row, existing_data):
     QUEST_FIRST_CLEAR_COUNT = 5
     QUEST_COMPLETE_COUNT = 3
     reward_template = '\n{{{{DropReward|droptype=First|itemtype={}|item={}|exact={}}}}}'
 
-    found = False
-    for index,existing_row in enumerate(existing_data):
-        if existing_row[1]['Id'] == row[ROW_INDEX]:
-            found = True
-            break
-    assert(found)
+    index = existing_data.find('Id', row[ROW_INDEX])
+    assert(index is not None)
 
+    existing_row = existing_data[index]
     curr_row = existing_row[1]
     first_clear_dict = {
         '8': reward_template.format(
@@ -585,16 +1318,15 @@ def process_QuestRewardData(row, existing_data):
 
     existing_data[index] = (existing_row[0], curr_row)
 
+@joins('_Gid')
+@columns('_QuestBonusType', '_QuestBonusCount')
 def process_QuestBonusData(row, existing_data):
 
-    found = False
-    for index,existing_row in enumerate(existing_data):
-        if existing_row[1]['_Gid'] == row['_Id']:
-            found = True
-            break
-    if not found:
+    index = existing_data.find('_Gid', row['_Id'])
+    if index is None:
         return
 
+    existing_row = existing_data[index]
     curr_row = existing_row[1]
     if row['_QuestBonusType'] == '1':
         curr_row['DailyDropQuantity'] = row['_QuestBonusCount']
@@ -605,6 +1337,9 @@ def process_QuestBonusData(row, existing_data):
 
     existing_data[index] = (existing_row[0], curr_row)
 
+@uses_tables(TEXT_LABEL_JP, SKILL_DATA_NAME)
+@columns('_BaseId', '_FormId', '_Name', '_Type', '_Rarity', '_ElementalType', '_MinHp', '_MaxHp', '_MinAtk', '_MaxAtk',
+         '_Skill', '_Abilities11', '_Abilities21', '_Text', '_SellCoin', '_SellDewPoint')
 def process_WeaponData(row, existing_data):
     new_row = OrderedDict()
 
@@ -642,16 +1377,17 @@ def process_WeaponData(row, existing_data):
 
     existing_data.append((new_row['WeaponName'], new_row))
 
+@joins('Id')
+@columns('_FortCraftLevel', '_AssembleCoin', '_DisassembleCoin', '_MainWeaponId', '_MainWeaponQuantity',
+         *numbered_columns('_CraftEntityType{}', range(1, 6)), *numbered_columns('_CraftEntityId{}', range(1, 6)),
+         *numbered_columns('_CraftEntityQuantity{}', range(1, 6)))
 def process_WeaponCraftData(row, existing_data):
     WEAPON_CRAFT_DATA_MATERIAL_COUNT = 5
 
-    found = False
-    for index,existing_row in enumerate(existing_data):
-        if existing_row[1]['Id'] == row[ROW_INDEX]:
-            found = True
-            break
-    assert(found)
+    index = existing_data.find('Id', row[ROW_INDEX])
+    assert(index is not None)
 
+    existing_row = existing_data[index]
     curr_row = existing_row[1]
     curr_row['FortCraftLevel'] = row['_FortCraftLevel']
     curr_row['AssembleCoin'] = row['_AssembleCoin']
@@ -665,43 +1401,51 @@ def process_WeaponCraftData(row, existing_data):
         curr_row['CraftMaterialQuantity{}'.format(i)] = row['_CraftEntityQuantity{}'.format(i)]
     existing_data[index] = (existing_row[0], curr_row)
 
+@joins('Id')
+@columns('_CraftWeaponId', '_CraftNodeId', '_ParentCraftNodeId', '_CraftGroupId')
 def process_WeaponCraftTree(row, existing_data):
-    found = False
-    for index,existing_row in enumerate(existing_data):
-        if existing_row[1]['Id'] == row['_CraftWeaponId']:
-            found = True
-            break
-    assert(found)
+    index = existing_data.find('Id', row['_CraftWeaponId'])
+    assert(index is not None)
 
+    existing_row = existing_data[index]
     curr_row = existing_row[1]
     curr_row['CraftNodeId'] = row['_CraftNodeId']
     curr_row['ParentCraftNodeId'] = row['_ParentCraftNodeId']
     curr_row['CraftGroupId'] = row['_CraftGroupId']
     existing_data[index] = (existing_row[0], curr_row)
 
-def build_wikitext_row(template_name, row, delim='|'):
-    row_str = '{{' + template_name + delim
+def compile_wikitext_formatter(template_name, delim='|'):
+    head = '{{' + template_name + delim
+    tail = '\n}}' if delim[0] == '\n' else '}}'
     if template_name in ORDERING_DATA:
-        key_source = ORDERING_DATA[template_name]
+        fields = tuple((k, k + '=') for k in ORDERING_DATA[template_name])
+        plans = {}
+        def format_row(row):
+            if row.__class__ is Record:
+                shape, values = row.layout()
+                try:
+                    plan = plans[shape]
+                except KeyError:
+                    plan = plans[shape] = shape.plan(fields)
+                return head + delim.join([prefix + str(values[i]) for prefix, i in plan]) + tail
+            return head + delim.join([prefix + str(row[k]) for k, prefix in fields if k in row]) + tail
     else:
-        key_source = row.keys()
-    row_str += delim.join(['{}={}'.format(k, row[k]) for k in key_source if k in row])
-    if delim[0] == '\n':
-        row_str += '\n'
-    row_str += '}}'
-    return row_str
+        # rows of the same template can have different keys, so each row keeps its own key order
+        def format_row(row):
+            return head + delim.join([k + '=' + str(v) for k, v in row.items()]) + tail
+    return format_row
+
+def build_wikitext_row(template_name, row, delim='|'):
+    try:
+        format_row = WIKITEXT_FORMATTERS[(template_name, delim)]
+    except KeyError:
+        format_row = WIKITEXT_FORMATTERS[(template_name, delim)] = compile_wikitext_formatter(template_name, delim)
+    return format_row(row)
 
 def row_as_wikitext(row, template_name, display_name = None):
-    text = ""
     if display_name:
-        text += display_name
-        text += ENTRY_LINE_BREAK
-        text += build_wikitext_row(template_name, row, delim='\n|')
-        text += ENTRY_LINE_BREAK
-    else:
-        text += build_wikitext_row(template_name, row)
-        text += '\n'
-    return text
+        return display_name + ENTRY_LINE_BREAK + build_wikitext_row(template_name, row, delim='\n|') + ENTRY_LINE_BREAK
+    return build_wikitext_row(template_name, row) + '\n'
 
 def row_as_wikitable(row, template_name=None, display_name=None, delim=' || '):
     return '|-\n| {}\n'.format(delim.join([v for v in row.values()]))
@@ -741,6 +1485,333 @@ DATA_PARSER_PROCESSING = {
             ('WeaponCraftData', process_WeaponCraftData)])
 }
 
+class ParserStage:
+    # one input file of a dataset and the process_* function its rows go through
+    def __init__(self, file_name, func):
+        self.file_name = file_name
+        self.func = func
+        # process_* functions take (row, existing_data) or (row, existing_data, extra_data)
+        self.arity = len(inspect.signature(func).parameters)
+        if self.arity not in (2, 3):
+            raise TypeError('{} takes {} parameters, expected (row, existing_data[, extra_data])'.format(func.__name__, self.arity))
+        self.columns = getattr(func, 'columns', None)
+        self.tables = getattr(func, 'tables', ())
+        self.joins = getattr(func, 'joins', None)
+
+class DataParserSpec:
+    # everything a dataset declares up front, resolved once when the module loads
+    def __init__(self, data_name, template, formatter, process_info):
+        self.template = template
+        self.formatter = formatter
+        # process_info is either the process function of the data_name file or a list of (file_name, process_function)
+        if callable(process_info):
+            process_info = [(data_name, process_info)]
+        self.stages = [ParserStage(file_name, func) for file_name, func in process_info]
+        self.input_files = [stage.file_name for stage in self.stages]
+        self.tables = {table for stage in self.stages for table in stage.tables}
+        self.join_keys = tuple(OrderedDict.fromkeys(key for stage in self.stages for key in (stage.joins or ())))
+        # rows only have to be kept until emit when a later stage goes back to them
+        self.streamable = all(stage.joins is None for stage in self.stages)
+        # editing the process functions or the formatter of a dataset rebuilds it like a changed input would
+        self.code_hash = source_hash([formatter] + [stage.func for stage in self.stages])
+
+def source_hash(funcs):
+    digest = hashlib.sha1()
+    for func in funcs:
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = getattr(func, '__qualname__', repr(func))
+        digest.update(source.encode('utf-8'))
+    return digest.hexdigest()
+
+# key of the process function and formatter source hash among the input hashes of a manifest entry
+MANIFEST_CODE_KEY = 'code'
+# key of the export formats written by the last build, they are not inputs so a build for fewer formats is still up to date
+MANIFEST_EXPORTS_KEY = 'exports'
+DATA_PARSERS = {data_name: DataParserSpec(data_name, *info) for data_name, info in DATA_PARSER_PROCESSING.items()}
+
+def get_input_files(data_name):
+    return DATA_PARSERS[data_name].input_files
+
+def get_shared_tables(data_name):
+    # the shared tables a dataset needs loaded before it runs, declared with @uses_tables
+    return DATA_PARSERS[data_name].tables
+
+def get_locale_label_file(locale):
+    # en -> TextLabel, jp -> TextLabelJP, zh -> TextLabelZH
+    if locale == 'en':
+        return TEXT_LABEL
+    return TEXT_LABEL + locale.upper()
+
+def get_locale_dir(locale):
+    return out_dir if locale is None else out_dir+locale+'/'
+
+def get_output_name(data_name, locale):
+    return data_name+EXT if locale is None else locale+'/'+data_name+EXT
+
+def get_dataset_inputs(data_name, ordering_path='', locale=None):
+    # every file that can change the output of a dataset
+    paths = [in_dir+file_name+EXT for file_name in get_input_files(data_name)]
+    paths.append(in_dir+(TEXT_LABEL if locale is None else get_locale_label_file(locale))+EXT)
+    paths += [in_dir+table+EXT for table in sorted(get_shared_tables(data_name))]
+    if ordering_path:
+        paths.append(ordering_path)
+    return paths
+
+def file_hash(path):
+    # files used by many datasets are only read once per run
+    if path not in FILE_HASHES:
+        try:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as in_file:
+                for chunk in iter(lambda: in_file.read(1 << 20), b''):
+                    digest.update(chunk)
+            FILE_HASHES[path] = digest.hexdigest()
+        except FileNotFoundError:
+            FILE_HASHES[path] = None
+    return FILE_HASHES[path]
+
+def load_manifest(out_dir):
+    try:
+        with open(out_dir+MANIFEST, 'r', encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest(out_dir, manifest):
+    with open(out_dir+MANIFEST, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+
+def missing_exports(data_name, locale=None):
+    data_out_dir = get_locale_dir(locale)
+    return (('jsonl' in EXPORT_FORMATS and not os.path.exists(data_out_dir+data_name+JSONL_EXT))
+        or ('sqlite' in EXPORT_FORMATS and not os.path.exists(data_out_dir+SQLITE_DB)))
+
+def find_changed_datasets(manifest, data_names, ordering_path='', force=False, locale=None, always=()):
+    # returns the datasets to rebuild along with the input hashes to record for them, datasets in always are rebuilt regardless
+    changed = {}
+    for data_name in data_names:
+        input_hashes = {path: file_hash(path) for path in get_dataset_inputs(data_name, ordering_path, locale)}
+        input_hashes[MANIFEST_CODE_KEY] = DATA_PARSERS[data_name].code_hash
+        recorded = dict(manifest.get(data_name, {}))
+        exported = set(recorded.pop(MANIFEST_EXPORTS_KEY, ()))
+        if (force or data_name in always or recorded != input_hashes or not os.path.exists(get_locale_dir(locale)+data_name+EXT)
+                or not EXPORT_FORMATS <= exported or missing_exports(data_name, locale)):
+            input_hashes[MANIFEST_EXPORTS_KEY] = sorted(EXPORT_FORMATS)
+            changed[data_name] = input_hashes
+    return changed
+
+def run_data_parser(data_name, locale=None):
+    # returns the profile summary when profiling
+    if locale is not None:
+        TEXT_LABEL_DICT['en'] = LOCALE_LABELS[locale]
+    data_out_dir = get_locale_dir(locale)
+    parser = DataParser(data_name)
+    parser.delta = EntityDelta(load_fingerprints(data_out_dir, data_name))
+    if EXPORT_FORMATS:
+        parser.export = RowExporter(data_name, parser.template, data_out_dir, EXPORT_FORMATS)
+    profile = cProfile.Profile() if data_name == CPROFILE_DATASET else None
+    start = time.perf_counter()
+    if profile is not None:
+        profile.enable()
+    if parser.can_stream():
+        parser.stream(data_out_dir)
+    else:
+        parser.process()
+        parser.emit(data_out_dir)
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(data_out_dir+data_name+'.prof')
+        print('cProfile of {} saved to {}{}.prof'.format(data_name, data_out_dir, data_name))
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(15)
+    save_delta(data_out_dir, data_name, parser.delta)
+    if parser.export is not None:
+        parser.export.close()
+    if PROFILER is None:
+        return None
+    return PROFILER.summarize(data_name, time.perf_counter() - start, len(parser.row_data))
+
+def run_dataset(task):
+    # runs a dataset for each of its locales back to back, so the table cache only tokenizes its inputs once
+    data_name, locales = task
+    return data_name, [(locale, run_data_parser(data_name, locale)) for locale in locales]
+
+def init_worker(shared_tables):
+    # workers are forked where possible, so these are shared copy-on-write with the main process
+    global in_dir, out_dir, ORDERING_DATA, TEXT_LABEL_DICT, LOCALE_LABELS, SKILL_DATA_NAMES, PROFILER, CPROFILE_DATASET, EXPORT_FORMATS
+    in_dir, out_dir, ORDERING_DATA, TEXT_LABEL_DICT, LOCALE_LABELS, SKILL_DATA_NAMES, PROFILER, CPROFILE_DATASET, EXPORT_FORMATS = shared_tables
+    if PROFILER is not None:
+        PROFILER.start()
+
+def run_datasets(tasks, jobs):
+    # tasks maps each data name to the locales to build it for, returns the profile summaries
+    profiles = {}
+    def save_results(data_name, results):
+        for locale, profile in results:
+            print('Saved {}'.format(get_output_name(data_name, locale)))
+            profiles[get_output_name(data_name, locale)[:-len(EXT)]] = profile
+    if jobs <= 1:
+        for task in tasks.items():
+            save_results(*run_dataset(task))
+        return profiles
+    # start the biggest inputs first so a slow table doesn't end up running alone at the end
+    def input_size(task):
+        try:
+            return os.path.getsize(in_dir+task[0]+EXT)
+        except OSError:
+            return 0
+    start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+    context = multiprocessing.get_context(start_method)
+    shared_tables = (in_dir, out_dir, ORDERING_DATA, TEXT_LABEL_DICT, LOCALE_LABELS, SKILL_DATA_NAMES, PROFILER, CPROFILE_DATASET, EXPORT_FORMATS)
+    with context.Pool(jobs, initializer=init_worker, initargs=(shared_tables,)) as pool:
+        for data_name, results in pool.imap_unordered(run_dataset, sorted(tasks.items(), key=input_size, reverse=True)):
+            save_results(data_name, results)
+    return profiles
+
+def save_profile_report(out_dir, profiles):
+    with open(out_dir+PROFILE_REPORT, 'w', encoding='utf-8') as report_file:
+        json.dump(profiles, report_file, indent=4)
+    print('\nProfile (slowest first), full report saved to {}{}'.format(out_dir, PROFILE_REPORT))
+    print('  {:<24}{:>10}{:>12}{:>10}{:>12}{:>10}'.format('dataset', 'wall (s)', 'rows/s', 'peak MB', 'labels', 'misses'))
+    for data_name, summary in sorted(profiles.items(), key=lambda item: item[1]['wall'], reverse=True):
+        print('  {:<24}{:>10.3f}{:>12.0f}{:>10.1f}{:>12}{:>10}'.format(
+            data_name, summary['wall'], summary['rows_per_second'], summary['peak_memory'] / (1 << 20),
+            summary['label_lookups'], summary['label_misses']))
+
+def load_label_table(label_file, label_index):
+    # label tables stay loaded between --watch rebuilds until their file changes
+    if label_file not in LABEL_TABLES:
+        with profile_stage(LABEL_PROFILE_NAME, label_file):
+            LABEL_TABLES[label_file] = load_text_label(in_dir+label_file+EXT, label_index)
+    return LABEL_TABLES[label_file]
+
+def build_datasets(data_names, locales, args):
+    # returns False when every dataset was up to date
+    global SKILL_DATA_NAMES
+    manifests = {}
+    changed = {}
+    tasks = {}
+    for locale in locales:
+        for sub_dir in (DELTA_DIR, FINGERPRINT_DIR):
+            if not os.path.exists(get_locale_dir(locale)+sub_dir):
+                os.makedirs(get_locale_dir(locale)+sub_dir)
+        manifests[locale] = load_manifest(get_locale_dir(locale))
+        # datasets named in --only are being worked on, so they are rebuilt even if nothing they read changed
+        always = args.only.split(',') if args.only else ()
+        changed[locale] = find_changed_datasets(manifests[locale], data_names, ordering_path=args.j, force=args.force, locale=locale, always=always)
+        for data_name in data_names:
+            if data_name in changed[locale]:
+                tasks.setdefault(data_name, []).append(locale)
+            elif not args.watch:
+                print('Skipped {} (inputs unchanged)'.format(get_output_name(data_name, locale)))
+    if not tasks:
+        return False
+
+    # only load the shared tables that the datasets being built declared with @uses_tables
+    TABLE_CACHE.clear()
+    needed_tables = set()
+    for data_name, data_locales in tasks.items():
+        needed_tables.update(get_shared_tables(data_name))
+        for file_name in get_input_files(data_name):
+            TABLE_CACHE.expect(in_dir+file_name+EXT, len(data_locales))
+    if SKILL_DATA_NAME in needed_tables:
+        TABLE_CACHE.expect(in_dir+SKILL_DATA_NAME+EXT)
+
+    if None in locales or 'en' in locales:
+        TEXT_LABEL_DICT['en'] = load_label_table(TEXT_LABEL, args.label_index)
+    if TEXT_LABEL_JP in needed_tables or 'jp' in locales:
+        try:
+            TEXT_LABEL_DICT['jp'] = load_label_table(TEXT_LABEL_JP, args.label_index)
+        except:
+            pass
+    for locale in locales:
+        if locale is None:
+            continue
+        label_file = get_locale_label_file(locale)
+        if label_file == TEXT_LABEL_JP and 'jp' in TEXT_LABEL_DICT:
+            LOCALE_LABELS[locale] = TEXT_LABEL_DICT['jp']
+        elif label_file != TEXT_LABEL and not os.path.exists(in_dir+label_file+EXT):
+            print('Could not find {}{} for locale {}'.format(label_file, EXT, locale))
+            sys.exit(1)
+        else:
+            LOCALE_LABELS[locale] = load_label_table(label_file, args.label_index)
+    if SKILL_DATA_NAME in needed_tables and SKILL_DATA_NAMES is None:
+        with profile_stage(LABEL_PROFILE_NAME, SKILL_DATA_NAME):
+            SKILL_DATA_NAMES = csv_as_index(in_dir+SKILL_DATA_NAME+EXT, value_key='_Name')
+
+    # find_fmt_params(in_dir, out_dir)
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    profiles = run_datasets(tasks, jobs)
+    if PROFILER is not None:
+        label_stages = PROFILER.datasets.get(LABEL_PROFILE_NAME, {})
+        profiles[LABEL_PROFILE_NAME] = PROFILER.summarize(
+            LABEL_PROFILE_NAME, sum(stats['wall'] for stats in label_stages.values()), 0)
+        save_profile_report(out_dir, profiles)
+
+    for locale in locales:
+        manifests[locale].update(changed[locale])
+        save_manifest(get_locale_dir(locale), manifests[locale])
+    return True
+
+def snapshot_inputs(ordering_path=''):
+    snapshot = {}
+    with os.scandir(in_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(EXT) and entry.is_file():
+                stat = entry.stat()
+                snapshot[in_dir+entry.name] = (stat.st_mtime_ns, stat.st_size)
+    if ordering_path and os.path.exists(ordering_path):
+        stat = os.stat(ordering_path)
+        snapshot[ordering_path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+def watch_inputs(data_names, locales, args):
+    # polls the input directory and rebuilds the datasets whose inputs changed, with the label tables kept loaded
+    global SKILL_DATA_NAMES
+    print('Watching {} for changes, Ctrl+C to stop'.format(in_dir))
+    snapshot = snapshot_inputs(args.j)
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        current = snapshot_inputs(args.j)
+        if current == snapshot:
+            continue
+        # new master data arrives as a burst of file writes, wait for it to settle
+        settled = time.monotonic()
+        while time.monotonic() - settled < args.debounce:
+            time.sleep(WATCH_INTERVAL)
+            latest = snapshot_inputs(args.j)
+            if latest != current:
+                current = latest
+                settled = time.monotonic()
+        changed_paths = [path for path in set(snapshot) | set(current) if snapshot.get(path) != current.get(path)]
+        snapshot = current
+
+        for path in changed_paths:
+            FILE_HASHES.pop(path, None)
+            table_name = os.path.basename(path)[:-len(EXT)]
+            close_label_table(table_name)
+            if table_name == SKILL_DATA_NAME:
+                SKILL_DATA_NAMES = None
+        if args.j in changed_paths:
+            with open(args.j, 'r') as json_ordering_fp:
+                ORDERING_DATA.clear()
+                ORDERING_DATA.update(json.load(json_ordering_fp))
+            WIKITEXT_FORMATTERS.clear()
+
+        print('Changed {}'.format(', '.join(sorted(os.path.basename(path) for path in changed_paths))))
+        start = time.perf_counter()
+        try:
+            if build_datasets(data_names, locales, args):
+                print('Rebuilt in {:.2f}s'.format(time.perf_counter() - start))
+            else:
+                print('Nothing to rebuild')
+        except Exception:
+            # a half written file can fail to parse, keep watching for the rest of it
+            traceback.print_exc()
+            print('Rebuild failed, waiting for the next change')
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Process CSV data into Wikitext.')
     parser.add_argument('-i', type=str, help='directory of input text files', default='./')
@@ -748,6 +1819,17 @@ if __name__ == '__main__':
     parser.add_argument('-j', type=str, help='path to json file with ordering', default='')
     # parser.add_argument('-data', type=list)
     parser.add_argument('--delete_old', help='delete older output files', dest='delete_old', action='store_true')
+    parser.add_argument('--jobs', type=int, help='number of worker processes, 0 for one per CPU (default: 1)', default=1)
+    parser.add_argument('--force', help='rebuild every dataset even if its inputs are unchanged', dest='force', action='store_true')
+    parser.add_argument('--label_index', type=str, help='directory of compiled text label indexes (default: ./.label-index)', default='./.label-index')
+    parser.add_argument('--profile', help='save per dataset and per stage timings, memory and label lookups (slower)', dest='profile', action='store_true')
+    parser.add_argument('--cprofile', type=str, help='save a cProfile of the named dataset', default='')
+    parser.add_argument('--only', type=str, help='comma separated datasets to build even if unchanged, only their inputs are loaded (e.g. AbilityData,QuestData)', default='')
+    parser.add_argument('--jsonl', help='also write the processed rows of each dataset as json lines', dest='jsonl', action='store_true')
+    parser.add_argument('--sqlite', help='also write the processed rows into {}, one table per template'.format(SQLITE_DB), dest='sqlite', action='store_true')
+    parser.add_argument('--watch', help='keep running and rebuild the datasets whose inputs change', dest='watch', action='store_true')
+    parser.add_argument('--debounce', type=float, help='seconds without further changes before a --watch rebuild (default: 1)', default=1.0)
+    parser.add_argument('--locales', type=str, help='comma separated locales to build in one pass, each into its own sub directory (e.g. en,jp)', default='')
 
     args = parser.parse_args()
     if args.delete_old:
@@ -766,19 +1848,34 @@ if __name__ == '__main__':
     in_dir = args.i if args.i[-1] == '/' else args.i+'/'
     out_dir = args.o if args.o[-1] == '/' else args.o+'/'
 
-    TEXT_LABEL_DICT['en'] = csv_as_index(in_dir+TEXT_LABEL+EXT, tabs=True)
-    try:
-        TEXT_LABEL_DICT['jp'] = csv_as_index(in_dir+TEXT_LABEL_JP+EXT, tabs=True)
-    except:
-        pass
-    SKILL_DATA_NAMES = csv_as_index(in_dir+SKILL_DATA_NAME+EXT, value_key='_Name')
-
-    # find_fmt_params(in_dir, out_dir)
-
-    for data_name, process_params in DATA_PARSER_PROCESSING.items():
-        template, formatter, process_info = process_params
-        parser = DataParser(data_name, template, formatter, process_info)
-        parser.process()
-        parser.emit(out_dir)
-        print('Saved {}{}'.format(data_name, EXT))
-
+    data_names = list(DATA_PARSER_PROCESSING)
+    if args.only:
+        data_names = args.only.split(',')
+        unknown = [data_name for data_name in data_names if data_name not in DATA_PARSER_PROCESSING]
+        if unknown:
+            print('Unknown datasets {}, choose from {}'.format(', '.join(unknown), ', '.join(DATA_PARSER_PROCESSING)))
+            sys.exit(1)
+        for data_name in data_names:
+            print('{} needs {}'.format(data_name, ', '.join(get_input_files(data_name) + sorted(get_shared_tables(data_name)))))
+
+    CPROFILE_DATASET = args.cprofile
+    if args.jsonl:
+        EXPORT_FORMATS.add('jsonl')
+    if args.sqlite:
+        EXPORT_FORMATS.add('sqlite')
+    if args.profile:
+        PROFILER = PipelineProfiler()
+        PROFILER.start()
+
+    # without --locales there is a single pass with the default labels straight into the output directory
+    locales = args.locales.split(',') if args.locales else [None]
+    if not build_datasets(data_names, locales, args) and not args.watch:
+        print('Nothing to rebuild, use --force to rebuild everything')
+    if args.watch:
+        # after the first build only changed inputs lead to rebuilds
+        args.force = False
+        args.only = ''
+        try:
+            watch_inputs(data_names, locales, args)
+        except KeyboardInterrupt:
+            print('Stopped watching {}'.format(in_dir))
@@ -4,7 +4,11 @@
 from PIL import Image
 import os
 import re
-import copy
+import json
+import time
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copyfile, rmtree
 import argparse
 
@@ -13,6 +17,15 @@ YCbCr_TYPES = ('Y', 'Cb', 'Cr')
 EXT = '.png'
 PORTRAIT_SUFFIX = '_portrait'
 WYRMPRINT_ALPHA = 'Wyrmprint_Alpha.png'
+# [(path, size, category)] of shared alphas for YCbCr images without their own, the first match is used
+SHARED_MASKS = [(WYRMPRINT_ALPHA, (1024, 1024), None)]
+# set up for each pool worker by init_worker
+WRITER = None
+# maps every (directory, base_name) to the size and mtime of its inputs and the outputs made from them
+MANIFEST = '.manifest.json'
+# the images and sub directories of every input directory with its mtime, only directories with another mtime are listed again
+SCAN_CACHE = '.scan_cache.json'
+SCAN_MTIME_SLACK = 2 * 10**9
 CATEGORY_REGEX = {
     'Ability_Icons': re.compile(r'^Icon_Ability_\d{7}$'),
     'Skill_Icons': re.compile(r'^Icon_Skill_\d{3}$'),
@@ -42,23 +55,15 @@ CATEGORY_NAME_FORMATS = {
 CATEGORY_EXTRA = ('Misc_Icon', 'Extra')
 
 
-image_name_pattern_alpha = re.compile(r'^(.*?)(_(A|alpha|alphaA8))?( #(\d+))?$')
-image_name_pattern_YCbCr = re.compile(r'^(.*?)_(Y|Cb|Cr)$')
+# format basename_channel(YCbCr) or basename_channel(Alpha) #hash_tag
+image_name_pattern = re.compile(r'^(.*?)(?:_(Y|Cb|Cr)|(?:_(A|alpha|alphaA8))?(?: #(\d+))?)$')
 def split_image_name(file_name):
-    # format basename_channel(YCbCr)
-    matches = image_name_pattern_YCbCr.match(file_name)
-    if matches:
-        base_name, _ = matches.groups()
+    base_name, YCbCr, channel, hash_tag = image_name_pattern.match(file_name).groups()
+    if YCbCr is not None:
         return base_name, 'YCbCr', 0
-    # format basename_channel(Alpha) #hash_tag
-    matches = image_name_pattern_alpha.match(file_name)
-    if matches:
-        base_name, _, channel, _, hash_tag = matches.groups()
-        channel = 'base' if channel is None else channel
-        hash_tag = 0 if hash_tag is None else int(hash_tag)
-        return base_name, channel, hash_tag
-    else:
-        return file_name, 'base', 0
+    channel = 'base' if channel is None else channel
+    hash_tag = 0 if hash_tag is None else int(hash_tag)
+    return base_name, channel, hash_tag
 
 def merge_image_name(base_name, channel, hash_tag):
     image_name = base_name
@@ -69,38 +74,59 @@ def merge_image_name(base_name, channel, hash_tag):
     image_name += EXT
     return image_name
 
-def build_image_dict(current_dir, images={}):
-    # TODO: maybe glob?
+def scan_dir(current_dir, cache, scanned, scan_start):
+    # returns the sub directories, how many of them are listed before the first image and {base_name: {channel: [hash_tag]}}
+    # a directory only gets another mtime when entries are added, removed or renamed, otherwise its cached scan is used
+    mtime = os.stat(current_dir).st_mtime_ns
+    cached = cache.get(current_dir)
+    if cached is not None and cached['mtime'] == mtime:
+        sub_dirs, first_image, dir_images = cached['dirs'], cached['first_image'], cached['images']
+    else:
+        sub_dirs = []
+        first_image = None
+        dir_images = {}
+        with os.scandir(current_dir) as it:
+            for entry in it:
+                if entry.is_dir():
+                    sub_dirs.append(entry.name)
+                    continue
+                if not entry.name.endswith(EXT) or entry.name == EXT:
+                    continue
+                if first_image is None:
+                    first_image = len(sub_dirs)
+                base_name, channel, hash_tag = split_image_name(entry.name[:-len(EXT)])
+                dir_images.setdefault(base_name, {}).setdefault(channel, []).append(hash_tag)
+    # a directory changed during the scan could change again within the same mtime
+    scanned[current_dir] = {'mtime': mtime if mtime < scan_start - SCAN_MTIME_SLACK else None,
+        'dirs': sub_dirs, 'first_image': first_image, 'images': dir_images}
+    return sub_dirs, first_image, dir_images
+
+def build_image_dict(current_dir, images=None, cache=None, scanned=None, scan_start=None):
+    # cache is the scanned directories of an earlier run, scanned gets the directories of this one
     if not os.path.exists(current_dir):
         return None
-    for f in os.listdir(current_dir):
-        fp = '{}/{}'.format(current_dir, f)
-        if os.path.isdir(fp):
-            build_image_dict(fp, images)
-        else:
-            file_name, file_ext = os.path.splitext(f)
-            if file_ext != EXT:
-                continue
-            base_name, channel, hash_tag = split_image_name(file_name)
-            if current_dir not in images:
-                images[current_dir] = {}
-            if base_name not in images[current_dir]:
-                images[current_dir][base_name] = {}
-            if channel not in images[current_dir][base_name]:
-                images[current_dir][base_name][channel] = []
-            images[current_dir][base_name][channel].append(hash_tag)
+    images = {} if images is None else images
+    cache = {} if cache is None else cache
+    scanned = {} if scanned is None else scanned
+    scan_start = time.time_ns() if scan_start is None else scan_start
+    sub_dirs, first_image, dir_images = scan_dir(current_dir, cache, scanned, scan_start)
+    # directories are added in the order of a recursive listing, as the sub directories listed before the first image come first
+    for n, name in enumerate(sub_dirs):
+        if n == first_image:
+            images[current_dir] = dict(dir_images)
+        build_image_dict('{}/{}'.format(current_dir, name), images, cache, scanned, scan_start)
+    if first_image is not None and current_dir not in images:
+        images[current_dir] = dict(dir_images)
     return images
 
 def filter_image_dict(images):
     no_merge = {}
-    ref = copy.deepcopy(images)
-    for dir_name in ref:
-        for base_name in ref[dir_name]:
-            if len(ref[dir_name][base_name]) == 1:
+    for dir_name in images:
+        for base_name in list(images[dir_name]):
+            if len(images[dir_name][base_name]) == 1:
                 if dir_name not in no_merge:
                     no_merge[dir_name] = {}
-                no_merge[dir_name][base_name] = images[dir_name][base_name]
-                del images[dir_name][base_name]
+                no_merge[dir_name][base_name] = images[dir_name].pop(base_name)
     return images, no_merge
 
 def print_image_dict(images, paths=True):
@@ -128,72 +154,97 @@ def find_best_alpha(merged):
     return best
 
 
-def merge_alpha(directory, base_name, alpha_type, base_tags, alpha_tags):
-    merged = {}
+def nearest_alpha_pairs(base_tags, alpha_tags):
     nearest_pair = {}
     for bh in base_tags:
         for ah in alpha_tags:
             if bh not in nearest_pair or abs(bh - ah) < abs(bh - nearest_pair[bh]):
                 nearest_pair[bh] = ah
+    return nearest_pair
 
-    for bh, ah in nearest_pair.items():
-        try:
-            base_img = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'base', bh)))
-            alph_img = Image.open('{}/{}'.format(directory, merge_image_name(base_name, alpha_type, ah)))
-        except Exception:
-            print(bh, ah)
-            print('ERR: {}/{}'.format(directory, merge_image_name(base_name, alpha_type, ah)))
-        if base_img.size != alph_img.size:
+def plan_alpha_merges(directory, base_name, channels):
+    # returns [(alpha_type, base_tag, alpha_tag, size)] widest first, read from the image headers without decoding
+    # a later alpha type replaces an earlier one for the same pair of tags but keeps its place
+    planned = {}
+    for alpha_type in ALPHA_TYPES:
+        if alpha_type not in channels:
             continue
-        r, g, b, _ = base_img.split()
-        if alpha_type == 'alphaA8':
-            _, _, _, a = alph_img.split()
-        else:
-            a = alph_img.convert('L')
-        merged[(bh, ah)] = Image.merge("RGBA", (r,g,b,a))
+        for bh, ah in nearest_alpha_pairs(channels['base'], channels[alpha_type]).items():
+            try:
+                base_size = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'base', bh))).size
+                alpha_size = Image.open('{}/{}'.format(directory, merge_image_name(base_name, alpha_type, ah))).size
+            except Exception:
+                print(bh, ah)
+                print('ERR: {}/{}'.format(directory, merge_image_name(base_name, alpha_type, ah)))
+                continue
+            if base_size != alpha_size:
+                continue
+            planned[(bh, ah)] = (alpha_type, bh, ah, base_size)
+    return sorted(planned.values(), key=(lambda x: x[3][0]), reverse=True)
+
+def merge_alpha(directory, base_name, alpha_type, bh, ah):
+    base_img = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'base', bh)))
+    alph_img = Image.open('{}/{}'.format(directory, merge_image_name(base_name, alpha_type, ah)))
+    r, g, b, _ = base_img.split()
+    if alpha_type == 'alphaA8':
+        _, _, _, a = alph_img.split()
+    else:
+        a = alph_img.convert('L')
+    return Image.merge("RGBA", (r,g,b,a))
+
+class AssetCache:
+    # shared images like the wyrmprint alpha decoded once per process, by (path, size)
+    # pool workers made with fork start with everything loaded before the pool was made
+    def __init__(self):
+        self.images = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, size=None):
+        key = (path, size)
+        with self.lock:
+            if key not in self.images:
+                img = Image.open(path).convert('L')
+                if size is not None and img.size != size:
+                    img = img.resize(size, Image.LANCZOS)
+                self.images[key] = img
+            return self.images[key]
+
+    def preload(self, masks):
+        # masks for any size or only a category are loaded once a merge asks for them
+        for path, size, _ in masks:
+            if size is not None:
+                self.get(path, size)
+
+ASSETS = AssetCache()
 
-    return merged
+def register_mask(path, size=None, category=None):
+    SHARED_MASKS.append((path, size, category))
+
+def find_mask(base_name, size):
+    # returns the (path, size, category) rule of the shared alpha the portrait takes, or None
+    category, _ = match_category(base_name + PORTRAIT_SUFFIX, size)
+    for rule in SHARED_MASKS:
+        _, mask_size, mask_category = rule
+        if (mask_size is None or mask_size == size) and (mask_category is None or mask_category == category):
+            return rule
+    return None
 
 def merge_YCbCr(directory, base_name, unique_alpha=False):
     Y_img = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'Y', 0)))
     _, _, _, Y = Y_img.convert('RGBA').split()
-    Cb = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'Cb', 0))).convert('L').resize(Y_img.size, Image.ANTIALIAS)
-    Cr = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'Cr', 0))).convert('L').resize(Y_img.size, Image.ANTIALIAS)
+    Cb = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'Cb', 0))).convert('L').resize(Y_img.size, Image.LANCZOS)
+    Cr = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'Cr', 0))).convert('L').resize(Y_img.size, Image.LANCZOS)
     if unique_alpha:
         a = Image.open('{}/{}'.format(directory, merge_image_name(base_name, 'alpha', 0))).convert('L')
-    elif Y_img.size == (1024, 1024):
-        a = Image.open(WYRMPRINT_ALPHA).convert('L')
     else:
-        a = None
+        mask = find_mask(base_name, Y_img.size)
+        a = ASSETS.get(mask[0], Y_img.size) if mask is not None else None
     if a is not None:
         r, g, b = Image.merge("YCbCr", (Y, Cb, Cr)).convert('RGB').split()
         return Image.merge("RGBA", (r, g, b, a))
     else:
         return Image.merge("YCbCr", (Y, Cb, Cr)).convert('RGB')    
 
-def merge_all_images(images):
-    merged_images = {}
-
-    for d in images:
-        for i in images[d]:
-            m = {}
-            if 'base' in images[d][i]:
-                a_res = {}
-                for alpha in ALPHA_TYPES:
-                    if alpha in images[d][i]:
-                        a_res = {**a_res, **merge_alpha(d, i, alpha, images[d][i]['base'], images[d][i][alpha])}
-                if len(a_res) > 0:
-                    # m['alpha'] = find_best_alpha(a_res)
-                    m['alpha'] = sorted(a_res.values(), key=(lambda x: x.size[0]), reverse=True)
-            if 'YCbCr' in images[d][i]:
-                m['YCbCr'] = merge_YCbCr(d, i, unique_alpha=('alpha' in images[d][i]))
-            if len(m) > 0:
-                if d not in merged_images:
-                    merged_images[d] = {}
-                merged_images[d][i] = m
-
-    return merged_images
-
 def match_category(file_name, file_size=None):
     for category, pattern in CATEGORY_REGEX.items():
         res = pattern.match(file_name)
@@ -229,51 +280,289 @@ def delete_empty_subdirectories(directory):
             except:
                 pass
 
-def save_merged_images(merged_images, in_dir, out_dir):
-    for d in merged_images:
-        # delete empty catagory folders in the previous directory
-        out_sub_dir = create_out_sub_dir(d, in_dir, out_dir, make_categories=True)
-        for i in merged_images[d]:
-            for t in merged_images[d][i]:
-                if t == 'YCbCr':
-                    img = merged_images[d][i][t]
-                    img_name = i + '_portrait'
-                    category, _ = match_category(img_name, img.size)
-                    save_path = '{}/{}/{}{}'.format(out_sub_dir, category, img_name, EXT)
-                    img.save(save_path)
-                elif t == 'alpha':
-                    max_w, max_h = merged_images[d][i][t][0].size
-                    for idx, img in enumerate(merged_images[d][i][t]):
-                        category, name_format = match_category(i, img.size)
-                        img_name = i
-                        if name_format is not None:
-                            img_name = name_format.format('#{}#'.format(str(idx)))
-                        if max_w > img.size[0] and max_h > img.size[1]:
-                            save_path = '{}/{}/{} (Small){}'.format(out_sub_dir, category, img_name, EXT)
-                        else:
-                            save_path = '{}/{}/{}{}'.format(out_sub_dir, category, img_name, EXT)
-                        if os.path.exists(save_path) and os.path.isfile(save_path):
-                            save_path = '{}#{}{}'.format(save_path.replace(EXT, ''), idx, EXT)
-                        img.save(save_path)
-        delete_empty_subdirectories(out_sub_dir)
+class ImageWriter:
+    # encodes merged images to PNG on background threads, at most max_in_flight of them are held waiting to be written
+    # output names are claimed by the caller before handing over, so naming never depends on which write finishes first
+    def __init__(self, max_in_flight=1):
+        self.executor = ThreadPoolExecutor(max_in_flight) if max_in_flight > 1 else None
+        self.slots = threading.BoundedSemaphore(max(max_in_flight, 1))
+        self.pending = set()
+        self.error = None
+        self.lock = threading.Lock()
+
+    def write(self, img, f):
+        if self.executor is None:
+            save_png(img, f)
+            return
+        # once handed over save_png cleans up after a failure, until then the claimed file is removed here
+        try:
+            self.slots.acquire()
+            future = self.executor.submit(save_png, img, f)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        # a failed write is kept until flush, finished futures leave pending before anyone waits on them
+        with self.lock:
+            self.pending.discard(future)
+            if self.error is None and not future.cancelled() and future.exception() is not None:
+                self.error = future.exception()
+        self.slots.release()
+
+    def flush(self):
+        # waits for every image handed over so far, re-raising the first failed write
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            # the done callback can run after result returns, so the error is kept from here too
+            try:
+                future.result()
+            except Exception as error:
+                with self.lock:
+                    if self.error is None:
+                        self.error = error
+        with self.lock:
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+
+def save_png(img, f):
+    # a half written image is removed so the next run sees it missing and merges it again
+    try:
+        with f:
+            img.save(f, format='PNG')
+    except Exception:
+        os.remove(f.name)
+        raise
+
+def claim_path(save_path, idx):
+    # the exclusive create claims the name even when parallel workers save the same one, whoever comes second gets #idx
+    try:
+        return open(save_path, 'xb')
+    except FileExistsError:
+        return open('{}#{}{}'.format(save_path.replace(EXT, ''), idx, EXT), 'wb')
+
+def merge_and_save_unit(unit, writer=None):
+    # merges one (directory, base_name) and hands each image to the writer as soon as it is merged
+    # returns the paths of the outputs
+    writer = writer or WRITER
+    outputs = []
+    try:
+        merge_unit_images(unit, writer, outputs)
+    except BaseException:
+        # a unit that fails partway is not in the manifest, its outputs so far would hold their names and push the next run to #idx
+        try:
+            writer.flush()
+        except Exception:
+            pass
+        for output in outputs:
+            try:
+                os.remove(output)
+            except FileNotFoundError:
+                pass
+        raise
+    return outputs
+
+def merge_unit_images(unit, writer, outputs):
+    d, i, channels, out_sub_dir = unit
+    if 'base' in channels:
+        planned = plan_alpha_merges(d, i, channels)
+        if planned:
+            max_w, max_h = planned[0][3]
+        for idx, (alpha_type, bh, ah, size) in enumerate(planned):
+            category, name_format = match_category(i, size)
+            img_name = i
+            if name_format is not None:
+                img_name = name_format.format('#{}#'.format(str(idx)))
+            if max_w > size[0] and max_h > size[1]:
+                save_path = '{}/{}/{} (Small){}'.format(out_sub_dir, category, img_name, EXT)
+            else:
+                save_path = '{}/{}/{}{}'.format(out_sub_dir, category, img_name, EXT)
+            # merged before the name is claimed, a failed merge must not leave an empty file holding it
+            img = merge_alpha(d, i, alpha_type, bh, ah)
+            f = claim_path(save_path, idx)
+            writer.write(img, f)
+            outputs.append(f.name)
+    if 'YCbCr' in channels:
+        img = merge_YCbCr(d, i, unique_alpha=('alpha' in channels))
+        img_name = i + PORTRAIT_SUFFIX
+        category, _ = match_category(img_name, img.size)
+        f = open('{}/{}/{}{}'.format(out_sub_dir, category, img_name, EXT), 'wb')
+        writer.write(img, f)
+        outputs.append(f.name)
+
+def init_worker(shared_masks, max_in_flight):
+    global WRITER
+    SHARED_MASKS[:] = shared_masks
+    WRITER = ImageWriter(max_in_flight)
+
+def merge_and_save_pooled_unit(numbered_unit):
+    # a pool can stop its workers as soon as the last result is in, so each unit is fully written before returning
+    n, unit = numbered_unit
+    outputs = merge_and_save_unit(unit)
+    WRITER.flush()
+    return n, outputs
+
+def load_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as json_file:
+            return json.load(json_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_json(path, data):
+    with open(path, 'w', encoding='utf-8') as json_file:
+        json_file.write(json.dumps(data))
+
+fallback_name_pattern = re.compile(r'^(.*)#\d+' + re.escape(EXT) + '$')
+def unit_key(directory, base_name, in_dir):
+    return os.path.relpath(directory, in_dir).replace(os.sep, '/') + '/' + base_name
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def unit_inputs(directory, base_name, channels):
+    # returns {file name: [size, mtime]} of every file the unit is made from
+    names = []
+    for c in channels:
+        if c == 'YCbCr':
+            names.extend(merge_image_name(base_name, t, 0) for t in YCbCr_TYPES)
+        else:
+            names.extend(merge_image_name(base_name, c, h) for h in channels[c])
+    inputs = {name: file_signature(directory + '/' + name) for name in names}
+    # portraits without their own alpha take the shared one of the first rule matching them, only the Y header is read for its size
+    if 'YCbCr' in channels and 'alpha' not in channels:
+        try:
+            with Image.open(directory + '/' + merge_image_name(base_name, 'Y', 0)) as Y_img:
+                mask = find_mask(base_name, Y_img.size)
+        except OSError:
+            mask = None
+        if mask is not None:
+            path, size, category = mask
+            inputs['{} ({})'.format(path, category or '{}x{}'.format(*size))] = file_signature(path)
+    return inputs
+
+def remove_outputs(entry, out_dir):
+    if entry is None:
+        return
+    for output in entry['outputs']:
+        try:
+            os.remove(out_dir + '/' + output)
+        except FileNotFoundError:
+            pass
+
+def outputs_exist(entry, out_dir):
+    return all(os.path.exists(out_dir + '/' + output) for output in entry['outputs'])
+
+def takes_free_name(entry, out_dir):
+    # an output only got #idx because its name was taken, it is made again once the name is free
+    for output in entry['outputs']:
+        fallback = fallback_name_pattern.match(output)
+        if fallback and not os.path.exists(out_dir + '/' + fallback.group(1) + EXT):
+            return True
+    return False
+
+def record_outputs(manifest, key, changed, outputs, out_dir):
+    if changed is not None:
+        manifest[key] = {'inputs': changed[key], 'outputs': [os.path.relpath(output, out_dir).replace(os.sep, '/') for output in outputs]}
 
+def find_changed_units(trees, in_dir, manifest, out_dir):
+    # returns {key: inputs} of the units to make again and the number of units whose inputs are all gone
+    # the previous outputs of both are removed first so that the units made again get the same names as in a full run
+    changed = {}
+    unchanged = []
+    for tree in trees:
+        for d in tree:
+            for i in tree[d]:
+                key = unit_key(d, i, in_dir)
+                inputs = unit_inputs(d, i, tree[d][i])
+                entry = manifest.get(key)
+                if entry is None or entry['inputs'] != inputs or not outputs_exist(entry, out_dir):
+                    changed[key] = inputs
+                else:
+                    unchanged.append(key)
+    removed = set(manifest) - set(changed) - set(unchanged)
+    for key in removed | set(changed):
+        remove_outputs(manifest.pop(key, None), out_dir)
+    for key in unchanged:
+        if takes_free_name(manifest[key], out_dir):
+            changed[key] = manifest[key]['inputs']
+            remove_outputs(manifest.pop(key), out_dir)
+    return changed, len(removed)
 
-def copy_Not_Merged_images(Not_Merged, in_dir, out_dir):
-    for d in Not_Merged:
+def find_units(images, in_dir, out_dir, changed=None):
+    # returns [(unit, key)] of every unit, or only the changed ones
+    units = []
+    out_sub_dirs = set()
+    for d in images:
         out_sub_dir = create_out_sub_dir(d, in_dir, out_dir, make_categories=True)
-        # if not os.path.exists(out_sub_dir + '/Not_Merged'):
-        #     os.makedirs(out_sub_dir + '/Not_Merged')
-        for i in Not_Merged[d]:
-            for c in Not_Merged[d][i]:
-                for h in Not_Merged[d][i][c]:
-                    category, name_format = match_category(i)
-                    if name_format is not None:
-                        img_name = name_format.format(h)
-                    else:
-                        category = ''
-                        img_name = merge_image_name(i, c, h)
-                    copyfile(d + '/' + merge_image_name(i, c, h), out_sub_dir + '/' + category + '/' + img_name + '.png')
+        out_sub_dirs.add(out_sub_dir)
+        for i in images[d]:
+            key = unit_key(d, i, in_dir)
+            if changed is None or key in changed:
+                units.append(((d, i, images[d][i], out_sub_dir), key))
+    return units, out_sub_dirs
+
+def merge_and_save_all(images, in_dir, out_dir, jobs=1, max_in_flight=1, manifest=None, changed=None):
+    # each (directory, base_name) is merged and saved on its own, nothing else stays in memory
+    # with jobs > 1 workers take whole units, nothing but the unit goes back and forth
+    # with changed only those units are merged and their outputs recorded in the manifest, returns the number merged
+    units, out_sub_dirs = find_units(images, in_dir, out_dir, changed)
+    if jobs <= 1:
+        writer = ImageWriter(max_in_flight)
+        try:
+            for unit, key in units:
+                record_outputs(manifest, key, changed, merge_and_save_unit(unit, writer), out_dir)
+        finally:
+            writer.close()
+    elif units:
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        context = multiprocessing.get_context(start_method)
+        ASSETS.preload(SHARED_MASKS)
+        with context.Pool(jobs, initializer=init_worker, initargs=(SHARED_MASKS, max_in_flight)) as pool:
+            for n, outputs in pool.imap_unordered(merge_and_save_pooled_unit, enumerate(unit for unit, _ in units)):
+                record_outputs(manifest, units[n][1], changed, outputs, out_dir)
+    for out_sub_dir in out_sub_dirs:
         delete_empty_subdirectories(out_sub_dir)
+    return len(units)
+
+def copy_Not_Merged_images(Not_Merged, in_dir, out_dir, manifest=None, changed=None):
+    # with changed only those units are copied and their outputs recorded in the manifest, returns the number copied
+    units, out_sub_dirs = find_units(Not_Merged, in_dir, out_dir, changed)
+    # if not os.path.exists(out_sub_dir + '/Not_Merged'):
+    #     os.makedirs(out_sub_dir + '/Not_Merged')
+    for (d, i, channels, out_sub_dir), key in units:
+        outputs = []
+        for c in channels:
+            for h in channels[c]:
+                category, name_format = match_category(i)
+                if name_format is not None:
+                    img_name = name_format.format(h)
+                else:
+                    category = ''
+                    img_name = merge_image_name(i, c, h)
+                outputs.append(out_sub_dir + '/' + category + '/' + img_name + '.png')
+                copyfile(d + '/' + merge_image_name(i, c, h), outputs[-1])
+        record_outputs(manifest, key, changed, outputs, out_dir)
+    for out_sub_dir in out_sub_dirs:
+        delete_empty_subdirectories(out_sub_dir)
+    return len(units)
 
 if __name__ == '__main__':
     try:
@@ -281,7 +570,11 @@ if __name__ == '__main__':
         parser.add_argument('-i', type=str, help='directory of input images', default='./')
         parser.add_argument('-o', type=str, help='directory of output images  (default: ./output)', default='./output')
         parser.add_argument('--delete_old', help='delete older output files', dest='delete_old', action='store_true')
-        parser.add_argument('-wpa', type=str, help='path to Wyrmprint_Alpha.png.', default='Wyrmprint_Alpha.png')
+        parser.add_argument('--force', help='list every input directory and merge every image even if unchanged since the last run', dest='force', action='store_true')
+        parser.add_argument('-wpa', type=str, help='path to Wyrmprint_Alpha.png.', default=WYRMPRINT_ALPHA)
+        parser.add_argument('--mask', type=str, help='shared alpha for YCbCr images without their own, as path:WIDTHxHEIGHT or path:Category, can be repeated and is used before -wpa', action='append', default=[])
+        parser.add_argument('--max_in_flight', type=int, help='merged images per process held waiting to be written, written on that many threads (default: 4)', default=4)
+        parser.add_argument('--jobs', type=int, help='number of worker processes, 0 for one per CPU (default: 1)', default=1)
 
         args = parser.parse_args()
         if args.delete_old:
@@ -294,14 +587,41 @@ if __name__ == '__main__':
         if not os.path.exists(args.o):
             os.makedirs(args.o)
 
-        WYRMPRINT_ALPHA = args.wpa
-        images = build_image_dict(args.i)
+        SHARED_MASKS.clear()
+        for mask in args.mask:
+            path, _, target = mask.rpartition(':')
+            size = re.match(r'^(\d+)x(\d+)$', target)
+            if size:
+                register_mask(path, size=(int(size.group(1)), int(size.group(2))))
+            elif target in CATEGORY_REGEX or target == 'Misc_Icon':
+                register_mask(path, category=target)
+            else:
+                parser.error('--mask {} is neither path:WIDTHxHEIGHT nor path:Category'.format(mask))
+        register_mask(args.wpa, size=(1024, 1024))
+        scan_cache = {} if args.force else load_json(args.o + '/' + SCAN_CACHE)
+        scanned = {}
+        images = build_image_dict(args.i, cache=scan_cache, scanned=scanned)
+        if scanned != scan_cache:
+            save_json(args.o + '/' + SCAN_CACHE, scanned)
         images, Not_Merged = filter_image_dict(images)
         # print_image_dict(images, False)
 
-        merged = merge_all_images(images)
-        save_merged_images(merged, args.i, args.o)
-        copy_Not_Merged_images(Not_Merged, args.i, args.o)
+        jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+        manifest = load_json(args.o + '/' + MANIFEST)
+        if args.force:
+            # the previous outputs go too, or they would keep their names and push the new ones to #idx
+            for entry in manifest.values():
+                remove_outputs(entry, args.o)
+            manifest = {}
+        changed, removed = find_changed_units((images, Not_Merged), args.i, manifest, args.o)
+        try:
+            merged = merge_and_save_all(images, args.i, args.o, jobs, args.max_in_flight, manifest, changed)
+            copied = copy_Not_Merged_images(Not_Merged, args.i, args.o, manifest, changed)
+        finally:
+            # saved even after a failure, every unit finished so far is skipped next time
+            save_json(args.o + '/' + MANIFEST, manifest)
+        print('Merged {} and copied {} images, {} unchanged, removed the outputs of {} missing images'.format(
+            merged, copied, len(manifest) - merged - copied, removed))
 
         print('\nThe following images were copied to {} without merging:'.format(args.o))
         print_image_dict(Not_Merged)
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import time
+
+import aiohttp
+
+from Process_DL_Data import DELTA_DIR, EDIT_THIS, ENTRY_LINE_BREAK, EXT, load_delta, merge_delta, write_delta
+
+USER_AGENT = 'dragalia-wiki-scripts publisher (aiohttp)'
+# titles per revisions query, the API limit for accounts without apihighlimits
+QUERY_BATCH_SIZE = 50
+MAXLAG = 5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RETRY_ERRORS = {'ratelimited', 'maxlag', 'readonly'}
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# a token can expire again while an edit sits out a long backoff
+BAD_TOKEN_RETRIES = 3
+# a delta being published is moved to this name, Process_DL_Data.py starts a new one for anything it finds meanwhile
+PUBLISHING_SUFFIX = '.publishing'
+
+class PublishError(Exception):
+    pass
+
+class RetryLater(Exception):
+    def __init__(self, message, delay=None):
+        super().__init__(message)
+        self.delay = delay
+
+class RateLimiter:
+    # spaces out request starts to at most rate per second across every task
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_time = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class WikiPublisher:
+    def __init__(self, session, api, concurrency=8, rate=0, retries=5, summary=''):
+        self.session = session
+        self.api = api
+        self.limiter = RateLimiter(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.summary = summary
+
+        # one edit token is shared by every edit and only fetched again once the wiki rejects it
+        self.token = None
+        self.token_lock = asyncio.Lock()
+        self.stats = {'edited': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0, 'retries': 0}
+        self.failed = set()
+
+    async def request(self, method, **params):
+        params['format'] = 'json'
+        params['formatversion'] = '2'
+        for attempt in range(self.retries + 1):
+            await self.limiter.wait()
+            try:
+                kwargs = {'params': params} if method == 'GET' else {'data': params}
+                async with self.session.request(method, self.api, **kwargs) as response:
+                    if response.status in RETRY_STATUS:
+                        retry_after = response.headers.get('Retry-After', '')
+                        raise RetryLater('HTTP {}'.format(response.status), float(retry_after) if retry_after.isdigit() else None)
+                    if response.status >= 400:
+                        raise PublishError('HTTP {} from {}'.format(response.status, self.api))
+                    result = await response.json(content_type=None)
+                error = result.get('error')
+                if error is not None and error.get('code') in RETRY_ERRORS:
+                    raise RetryLater(error.get('code'))
+                return result
+            except (RetryLater, aiohttp.ClientError, asyncio.TimeoutError) as error:
+                if attempt == self.retries:
+                    raise PublishError('Gave up after {} attempts: {!r}'.format(attempt + 1, error))
+                delay = getattr(error, 'delay', None)
+                if delay is None:
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+                self.stats['retries'] += 1
+                await asyncio.sleep(delay)
+
+    async def login(self, user, password):
+        result = await self.request('GET', action='query', meta='tokens', type='login')
+        login_token = result['query']['tokens']['logintoken']
+        result = await self.request('POST', action='login', lgname=user, lgpassword=password, lgtoken=login_token)
+        if result.get('login', {}).get('result') != 'Success':
+            raise PublishError('Login as {} failed: {}'.format(user, result.get('login', result)))
+
+    async def get_token(self, stale=None):
+        # tasks that saw the same stale token wait on the lock and reuse the first refresh
+        async with self.token_lock:
+            if self.token is None or self.token == stale:
+                result = await self.request('GET', action='query', meta='tokens', type='csrf')
+                self.token = result['query']['tokens']['csrftoken']
+            return self.token
+
+    async def current_texts(self, titles):
+        texts = {}
+        async def query_batch(batch):
+            async with self.semaphore:
+                result = await self.request('POST', action='query', prop='revisions', rvprop='content', rvslots='main', titles='|'.join(batch))
+            query = result.get('query', {})
+            normalized = {n['to']: n['from'] for n in query.get('normalized', [])}
+            for page in query.get('pages', []):
+                if page.get('revisions'):
+                    texts[normalized.get(page['title'], page['title'])] = page['revisions'][0]['slots']['main']['content']
+        await asyncio.gather(*[query_batch(titles[i:i+QUERY_BATCH_SIZE]) for i in range(0, len(titles), QUERY_BATCH_SIZE)])
+        return texts
+
+    async def edit(self, title, text):
+        async with self.semaphore:
+            token = await self.get_token()
+            for attempt in range(BAD_TOKEN_RETRIES + 1):
+                result = await self.request('POST', action='edit', title=title, text=text, summary=self.summary, token=token, bot='1', maxlag=MAXLAG)
+                if result.get('error', {}).get('code') != 'badtoken':
+                    break
+                token = await self.get_token(stale=token)
+        if 'error' in result:
+            raise PublishError('{}: {}'.format(result['error'].get('code'), result['error'].get('info', '')))
+        edit = result.get('edit', {})
+        if edit.get('result') != 'Success':
+            raise PublishError('edit result {}'.format(edit))
+        return not edit.get('nochange', False)
+
+    async def publish_page(self, title, text):
+        try:
+            edited = await self.edit(title, text)
+        except PublishError as error:
+            self.stats['failed'] += 1
+            self.failed.add(title)
+            print('Failed {}: {}'.format(title, error))
+            return
+        self.stats['edited' if edited else 'unchanged'] += 1
+
+def normalize_template_name(name):
+    name = name.replace('_', ' ').strip()
+    return name[:1].upper() + name[1:]
+
+def find_template(text, name=None):
+    # returns (start, end, name, [(key, value)]) of the first top level template in text, or of the first one called name
+    # nested templates and links are skipped over so their | do not split the parameters
+    start = text.find('{{')
+    while start != -1:
+        depth = 0
+        links = 0
+        parts = []
+        part_start = i = start
+        while i < len(text):
+            pair = text[i:i+2]
+            if pair == '{{':
+                depth += 1
+                i += 2
+                if depth == 1:
+                    part_start = i
+                continue
+            if pair == '}}':
+                depth -= 1
+                if depth == 0:
+                    parts.append(text[part_start:i])
+                    break
+                i += 2
+                continue
+            if pair == '[[' or (pair == ']]' and links):
+                links += 1 if pair == '[[' else -1
+                i += 2
+                continue
+            if text[i] == '|' and depth == 1 and not links:
+                parts.append(text[part_start:i])
+                part_start = i + 1
+            i += 1
+        else:
+            return None
+        end = i + 2
+        template_name = normalize_template_name(parts[0])
+        if name is None or template_name == name:
+            params = []
+            position = 0
+            for part in parts[1:]:
+                key, sep, value = part.partition('=')
+                # an = inside a nested template or link does not name the parameter
+                if sep and '{{' not in key and '[[' not in key:
+                    params.append((key.strip(), value.strip()))
+                else:
+                    position += 1
+                    params.append((str(position), part.strip()))
+            return start, end, template_name, params
+        start = text.find('{{', end)
+    return None
+
+def is_blank(value):
+    return not value or EDIT_THIS in value
+
+def merge_page(text, current):
+    # the generated template replaces the one on the wiki, but fields the generator leaves blank keep what editors filled in,
+    # fields only the wiki has are kept, and so is the page text around the template
+    # returns None when the wiki page does not have the template at all
+    generated = find_template(text)
+    if generated is None:
+        return text
+    start, end, name, params = generated
+    existing = find_template(current, name)
+    if existing is None:
+        return None
+    wiki_params = dict(existing[3])
+    keys = {key for key, _ in params}
+    merged = [(key, wiki_params[key] if is_blank(value) and not is_blank(wiki_params.get(key)) else value) for key, value in params]
+    merged.extend((key, value) for key, value in existing[3] if key not in keys)
+    if merged == params:
+        template = text[start:end]
+    else:
+        delim = '\n|' if '\n|' in text[start:end] else '|'
+        tail = '\n}}' if delim[0] == '\n' else '}}'
+        template = '{{' + text[start+2:end-2].split('|', 1)[0].strip() + delim + delim.join(key + '=' + value for key, value in merged) + tail
+    return current[:existing[0]] + template + current[existing[1]:]
+
+def split_entries(text):
+    # wikitext outputs alternate the display name and the page text
+    parts = text.split(ENTRY_LINE_BREAK)
+    return [(parts[i], parts[i+1]) for i in range(0, len(parts) - 1, 2)]
+
+def delta_path(data_dir, data_name):
+    return data_dir+DELTA_DIR+data_name+'.json'
+
+def pending_delta(path):
+    # what is left of an interrupted publish comes before the newer delta
+    return merge_delta(load_delta(path+PUBLISHING_SUFFIX), load_delta(path))
+
+def claim_delta(path):
+    if os.path.exists(path+PUBLISHING_SUFFIX):
+        release_delta(path)
+    if os.path.exists(path):
+        os.replace(path, path+PUBLISHING_SUFFIX)
+    return load_delta(path+PUBLISHING_SUFFIX)
+
+def release_delta(path, published=()):
+    # the entities that did not make it to the wiki go back in front of anything written meanwhile
+    # removed entities stay, deleting pages is left to the wiki editors
+    claimed = load_delta(path+PUBLISHING_SUFFIX)
+    for key in published:
+        claimed['added'].pop(key, None)
+        claimed['changed'].pop(key, None)
+    write_delta(path, merge_delta(claimed, load_delta(path)))
+    if os.path.exists(path+PUBLISHING_SUFFIX):
+        os.remove(path+PUBLISHING_SUFFIX)
+
+def delta_entries(delta):
+    return list(itertools.chain(delta['added'].items(), delta['changed'].items()))
+
+def load_pages(data_dir, data_names, full=False, claim=False):
+    # returns {title: text}, from the unpublished deltas or with full from the whole outputs
+    # along with {data_name: {key: titles}} of the delta entities to release once those titles are published
+    # with claim the deltas of the datasets with pages are claimed for publishing, the others are left alone
+    pages = {}
+    sources = {}
+    duplicates = 0
+    removed = 0
+    for data_name in data_names:
+        path = delta_path(data_dir, data_name)
+        delta = pending_delta(path)
+        if full:
+            with open(data_dir+data_name+EXT, 'r', encoding='utf-8') as data_file:
+                entries = split_entries(data_file.read())
+        else:
+            entries = list(itertools.chain.from_iterable(split_entries(entry['text']) for _, entry in delta_entries(delta)))
+            removed += len(delta['removed'])
+        # only template outputs map to pages, row and table outputs have no names to use as titles
+        if not entries or not entries[0][1].startswith('{{'):
+            if full or entries:
+                print('Skipped {} (no page entries)'.format(data_name))
+            continue
+        if claim:
+            delta = claim_delta(path)
+            if not full:
+                entries = list(itertools.chain.from_iterable(split_entries(entry['text']) for _, entry in delta_entries(delta)))
+            sources[data_name] = {key: {title for title, _ in split_entries(entry['text'])} for key, entry in delta_entries(delta)}
+        for title, text in entries:
+            if title in pages:
+                duplicates += 1
+            else:
+                pages[title] = text
+    if duplicates:
+        print('Skipped {} entries with an already used title'.format(duplicates))
+    if removed:
+        print('{} removed entries are left on the wiki'.format(removed))
+    return pages, sources
+
+def release_deltas(data_dir, sources, failed=()):
+    # an entity leaves the delta once every one of its pages made it to the wiki
+    failed = set(failed)
+    for data_name, keys in sources.items():
+        release_delta(delta_path(data_dir, data_name), [key for key, titles in keys.items() if not titles & failed])
+
+def get_data_names(data_dir, full=False):
+    if full:
+        names = [f[:-len(EXT)] for f in os.listdir(data_dir) if f.endswith(EXT)]
+    else:
+        names = set()
+        if os.path.exists(data_dir+DELTA_DIR):
+            for f in os.listdir(data_dir+DELTA_DIR):
+                if f.endswith('.json') or f.endswith('.json'+PUBLISHING_SUFFIX):
+                    names.add(f[:f.index('.json')])
+    return sorted(names)
+
+async def publish(pages, args):
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    # unsafe lets the cookie jar keep the session of a wiki addressed by IP, like the mock server
+    cookie_jar = aiohttp.CookieJar(unsafe=True)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, cookie_jar=cookie_jar, headers={'User-Agent': USER_AGENT}) as session:
+        publisher = WikiPublisher(session, args.api, concurrency=args.concurrency, rate=args.rate, retries=args.retries, summary=args.summary)
+        if args.user:
+            await publisher.login(args.user, args.password)
+        current = await publisher.current_texts(list(pages))
+        merged = {}
+        for title, text in pages.items():
+            if title not in current:
+                merged[title] = text
+                continue
+            merged[title] = merge_page(text, current[title])
+            if merged[title] is None:
+                publisher.stats['skipped'] += 1
+                print('Skipped {} (no {{{{{}}}}} on the wiki page)'.format(title, find_template(text)[2]))
+                del merged[title]
+        if args.force:
+            pages = merged
+        else:
+            # the wiki trims trailing whitespace off saved pages
+            pages = {title: text for title, text in merged.items() if current.get(title, '').strip() != text.strip()}
+            publisher.stats['unchanged'] += len(merged) - len(pages)
+        await asyncio.gather(*[publisher.publish_page(title, text) for title, text in pages.items()])
+        return publisher.stats, publisher.failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish processed wikitext through the MediaWiki edit API.')
+    parser.add_argument('-i', type=str, help='directory of processed output files (default: ./data-output)', default='./data-output')
+    parser.add_argument('--api', type=str, help='url of the wiki api.php', required=True)
+    parser.add_argument('--user', type=str, help='bot user name (default: $WIKI_USER)', default=os.environ.get('WIKI_USER', ''))
+    parser.add_argument('--password', type=str, help='bot password (default: $WIKI_PASSWORD)', default=os.environ.get('WIKI_PASSWORD', ''))
+    parser.add_argument('--only', type=str, help='comma separated datasets to publish (default: all)', default='')
+    parser.add_argument('--full', help='publish every entry instead of the latest delta', dest='full', action='store_true')
+    parser.add_argument('--force', help='edit pages even if their text is already up to date', dest='force', action='store_true')
+    parser.add_argument('--concurrency', type=int, help='requests in flight at once (default: 8)', default=8)
+    parser.add_argument('--rate', type=float, help='requests per second, 0 for no limit (default: 0)', default=0)
+    parser.add_argument('--retries', type=int, help='retries of a failed or rate limited request (default: 5)', default=5)
+    parser.add_argument('--timeout', type=float, help='seconds before a request is given up (default: 60)', default=60)
+    parser.add_argument('--summary', type=str, help='edit summary', default='Update from data mine')
+    parser.add_argument('--dry_run', help='only list the pages that would be published', dest='dry_run', action='store_true')
+
+    args = parser.parse_args()
+    data_dir = args.i if args.i[-1] == '/' else args.i+'/'
+    data_names = args.only.split(',') if args.only else get_data_names(data_dir, args.full)
+    pages, sources = load_pages(data_dir, data_names, args.full, claim=not args.dry_run)
+    if not pages:
+        release_deltas(data_dir, sources)
+        print('Nothing to publish')
+        sys.exit()
+    if args.dry_run:
+        for title in pages:
+            print(title)
+        sys.exit()
+
+    start = time.perf_counter()
+    try:
+        stats, failed = asyncio.run(publish(pages, args))
+    except PublishError as error:
+        release_deltas(data_dir, sources, failed=pages)
+        print(error)
+        sys.exit(1)
+    release_deltas(data_dir, sources, failed)
+    print('Finished {} pages in {:.1f}s: {edited} edited, {unchanged} unchanged, {skipped} skipped, {failed} failed, {retries} retries'.format(
+        len(pages), time.perf_counter() - start, **stats))
+    if stats['failed']:
+        sys.exit(1)